@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2023 by Jasonm23 / ocodo
+# Licenced under GPL v3 see LICENSE
+# See README.md for more info
+
+# Headless benchmarks for slideshow.py
+#
+# Usage:
+#     python benchmark.py [--only NAME,...] [--baseline FILE] [--save-baseline FILE] [image_dir ...]
+#
+# Prints one JSON object per measurement. With --baseline, also prints a
+# comparison for each timing against the same measurement in FILE, and
+# exits with status 1 if any got slower than --tolerance allows. Some
+# benchmarks also check what they measure, and a failed check exits with
+# status 1 too.
+#
+# Synthetic trees, playlists and large images are generated in a
+# temporary directory, and removed afterwards.
+
+import io
+import os
+import sys
+import json
+import time
+import array
+import shutil
+import argparse
+import tempfile
+import zipfile
+import tracemalloc
+import pyglet
+
+pyglet.options['headless'] = True
+
+import slideshow
+from concurrent.futures import ThreadPoolExecutor
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_image_dirs = [os.path.join(here, 'landscape_slides'),
+                      os.path.join(here, 'portrait_slides')]
+
+
+BENCHMARKS = ('discovery', 'playlist_file', 'stdin', 'playlist', 'session', 'sort',
+              'probe', 'archive', 'decode', 'load', 'tiles', 'draw', 'idle')
+# Measurements compared against a baseline, by name suffix
+LOWER_IS_BETTER = ('seconds', 'microseconds', '_ms', 'bytes', 'bytes_per_frame',
+                   'wakeups_per_second', 'cpu_percent', 'frames_loading')
+HIGHER_IS_BETTER = ('images_per_second',)
+# Timer noise: smaller differences never count as a regression
+NOISE_FLOORS = (('microseconds', 5.0), ('_ms', 5.0), ('seconds', 0.005))
+
+# Just the start of a 4000x3000 JPEG, enough for the header probe
+JPEG_HEADER = (b'\xff\xd8\xff\xc0\x00\x11\x08' + (3000).to_bytes(2, 'big') +
+               (4000).to_bytes(2, 'big') + b'\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01\xff\xd9')
+
+# What a drawn frame may allocate: the most on top of what's live at once,
+# and what may be left behind each frame (the clock's own bookkeeping)
+MAX_DRAW_PEAK_BYTES = 16 * 1024
+MAX_DRAW_RETAINED_BYTES_PER_FRAME = 8
+
+results = []
+failures = []
+
+
+def emit(name, **measurements):
+    result = dict(benchmark=name, **measurements)
+    results.append(result)
+    print(json.dumps(result), flush=True)
+
+
+def check(passed, message):
+    if not passed:
+        failures.append(message)
+        print(f"FAILED: {message}", file=sys.stderr, flush=True)
+
+
+def get_direction(name):
+    if name.endswith(HIGHER_IS_BETTER):
+        return -1
+    if name.endswith(LOWER_IS_BETTER):
+        return 1
+    return 0
+
+
+def get_noise_floor(name):
+    for suffix, floor in NOISE_FLOORS:
+        if name.endswith(suffix):
+            return floor
+    return 0
+
+
+def get_result_key(result):
+    # What was measured, as opposed to the measurements
+    return tuple(sorted((name, value) for name, value in result.items()
+                        if isinstance(value, (str, bool, int)) and not get_direction(name)))
+
+
+def compare_with_baseline(baseline_path, tolerance):
+    try:
+        with open(baseline_path) as file:
+            baseline = {get_result_key(result): result
+                        for result in map(json.loads, file) if 'benchmark' in result}
+    except FileNotFoundError:
+        print(f"No baseline at {baseline_path}, save one with --save-baseline", file=sys.stderr)
+        return True
+
+    passed = True
+    for result in results:
+        previous = baseline.get(get_result_key(result))
+        if previous is None:
+            continue
+        for name, value in result.items():
+            direction = get_direction(name)
+            if not direction or not previous.get(name) or not isinstance(value, (int, float)):
+                continue
+            change = (value - previous[name]) / previous[name]
+            regressed = (change * direction > tolerance
+                         and abs(value - previous[name]) > get_noise_floor(name))
+            passed = passed and not regressed
+            print(json.dumps(dict(get_result_key(result), measurement=name,
+                                  baseline=previous[name], value=value,
+                                  change=round(change, 3), regressed=regressed)),
+                  flush=True)
+    return passed
+
+
+def save_baseline(baseline_path):
+    with open(baseline_path, 'w') as file:
+        for result in results:
+            file.write(json.dumps(result) + '\n')
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    return value, time.perf_counter() - start
+
+
+def make_tree(root, count, per_directory=100, depth=20):
+    # count header only image files, per_directory to a directory, with
+    # directories nested up to depth deep
+    for index in range(0, count, per_directory):
+        directory_index = index // per_directory
+        directory = os.path.join(root, f"branch{directory_index // depth:05d}",
+                                 *(f"level{level:02d}" for level in range(directory_index % depth + 1)))
+        os.makedirs(directory, exist_ok=True)
+        for file_index in range(index, min(count, index + per_directory)):
+            with open(os.path.join(directory, f"IMG_{file_index:08d}.jpg"), 'wb') as file:
+                file.write(JPEG_HEADER)
+
+
+def make_flat_directory(directory, count):
+    os.makedirs(directory)
+    for index in range(count):
+        with open(os.path.join(directory, f"IMG_{index:08d}.jpg"), 'wb') as file:
+            file.write(JPEG_HEADER)
+
+
+def make_playlists(root, count, fanout=10):
+    # A playlist of playlists of playlists, listing count synthetic paths
+    paths = synthetic_paths(count)
+    leaves = fanout * fanout
+    per_leaf = -(-count // leaves)
+    with open(os.path.join(root, 'all.slideshow'), 'w') as top:
+        for branch in range(fanout):
+            top.write(f"branch{branch}.slideshow\n")
+            with open(os.path.join(root, f"branch{branch}.slideshow"), 'w') as middle:
+                for leaf in range(fanout):
+                    name = f"leaf{branch}-{leaf}.slideshow"
+                    middle.write(f"{name}\n")
+                    with open(os.path.join(root, name), 'w') as bottom:
+                        for _, path in zip(range(per_leaf), paths):
+                            bottom.write(f"{path}\n")
+    return os.path.join(root, 'all.slideshow')
+
+
+def make_large_images(root):
+    if slideshow.PILImage is None:
+        print("Pillow isn't installed, skipping large image fixtures", file=sys.stderr)
+        return []
+
+    Image = slideshow.PILImage
+    images = []
+    for name, size in (('large.jpg', (6000, 4000)), ('large.png', (4000, 3000))):
+        noise = Image.effect_noise(size, 48)
+        gradient = Image.linear_gradient('L').resize(size)
+        image = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+        path = os.path.join(root, name)
+        image.save(path)
+        images.append(path)
+
+    frames = [Image.effect_noise((800, 600), 32 + index).convert('P') for index in range(60)]
+    path = os.path.join(root, 'large.gif')
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0)
+    images.append(path)
+    return images
+
+
+def make_panorama(root, size=(50000, 2500)):
+    Image = slideshow.PILImage
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise((size[0] // 10, size[1] // 10), 48).resize(size)
+    image = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    path = os.path.join(root, 'panorama.jpg')
+    image.save(path, quality=90)
+    return path
+
+
+def bench_discovery(root, count):
+    flat = os.path.join(root, f"flat{count}")
+    make_flat_directory(flat, count)
+    paths, seconds = timed(slideshow.get_image_paths_from_directory, flat)
+    emit('discovery', layout='flat', files=count, found=len(paths),
+         seconds=round(seconds, 4))
+
+    tree = os.path.join(root, f"tree{count}")
+    make_tree(tree, count)
+    paths, seconds = timed(lambda: slideshow.get_image_paths(
+        slideshow.scan_directory(tree, recursive=True)))
+    emit('discovery', layout='nested', files=count, found=len(paths),
+         seconds=round(seconds, 4))
+
+
+def bench_playlist_file(root, count):
+    directory = os.path.join(root, f"playlists{count}")
+    os.makedirs(directory)
+    playlist = make_playlists(directory, count)
+    for compile in ('cold', 'indexed'):
+        paths, seconds = timed(slideshow.get_image_paths_from_file, playlist)
+        emit('playlist_file', compile=compile, entries=count, found=len(paths),
+             seconds=round(seconds, 4))
+
+
+def bench_stdin(count):
+    data = b''.join(f"{path}\n".encode() for path in synthetic_paths(count))
+    stdin = sys.stdin
+    sys.stdin = io.TextIOWrapper(io.BytesIO(data))
+    try:
+        paths, seconds = timed(slideshow.get_image_paths_from_stdin)
+    finally:
+        sys.stdin = stdin
+    playlist, playlist_seconds = timed(slideshow.Playlist, paths)
+    emit('stdin', entries=count, found=len(paths), seconds=round(seconds, 4),
+         playlist_seconds=round(playlist_seconds, 4))
+
+
+def bench_sort(root, count):
+    tree = os.path.join(root, f"sort{count}")
+    make_tree(tree, count)
+    slideshow.image_paths = slideshow.Playlist(slideshow.scan_directory(tree, recursive=True))
+    slideshow.image_index = 0
+
+    start = time.perf_counter()
+    slideshow.metadata = slideshow.MetadataIndex(slideshow.image_paths)
+    while not slideshow.metadata.complete:
+        time.sleep(0.001)
+    emit('sort', operation='metadata', entries=count,
+         seconds=round(time.perf_counter() - start, 4))
+
+    for key in ('alpha', 'created', 'modified', 'size', 'taken'):
+        for reverse in (False, True):
+            _, seconds = timed(slideshow.sort_image_paths, key, reverse)
+            emit('sort', operation=key, reverse=reverse, entries=count,
+                 seconds=round(seconds, 5))
+
+    _, seconds = timed(slideshow.image_paths.shuffle, 1)
+    emit('sort', operation='shuffle', entries=count, seconds=round(seconds, 5))
+    _, seconds = timed(slideshow.image_paths.reset_order)
+    emit('sort', operation='reset', entries=count, seconds=round(seconds, 5))
+
+
+def bench_probe(root, count, workers=8):
+    # Header reads the metadata index does for every image before it's shown
+    tree = os.path.join(root, f"probe{count}")
+    make_tree(tree, count)
+    paths = list(slideshow.scan_directory(tree, recursive=True))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        readable = sum(probe[3] for probe in threads.map(slideshow.probe_image, paths))
+    seconds = time.perf_counter() - start
+    emit('probe', entries=count, readable=readable, seconds=round(seconds, 4),
+         images_per_second=round(count / seconds))
+
+
+def bench_archive(root, count, paths, workers=8):
+    # Indexing a zip of header only images, first from its central
+    # directory then from the cached index, and probing its members
+    archive = os.path.join(root, f"archive{count}.zip")
+    with zipfile.ZipFile(archive, 'w') as file:
+        for index in range(count):
+            file.writestr(f"{index // 100:05d}/IMG_{index:08d}.jpg", JPEG_HEADER)
+    index_seconds = timed(slideshow.get_archive, archive)[1]
+    slideshow.archives.clear()
+    cached_index_seconds = timed(slideshow.get_archive, archive)[1]
+
+    members = slideshow.get_archive_paths(archive)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        readable = sum(probe[3] for probe in threads.map(slideshow.probe_image, members))
+    seconds = time.perf_counter() - start
+    emit('archive', entries=count, readable=readable,
+         index_seconds=round(index_seconds, 4),
+         cached_index_seconds=round(cached_index_seconds, 4),
+         images_per_second=round(count / seconds))
+
+    # The real images decoded at display size from files, and from a zip
+    # storing them and one deflating them
+    target_size = slideshow.get_decode_target_size()
+    sources = [('file', paths)]
+    for storage, compression in (('stored', zipfile.ZIP_STORED), ('deflated', zipfile.ZIP_DEFLATED)):
+        archive = os.path.join(root, f"{storage}.zip")
+        with zipfile.ZipFile(archive, 'w', compression) as file:
+            for path in paths:
+                file.write(path, os.path.basename(path))
+        sources.append((storage, slideshow.get_archive_paths(archive)))
+    for storage, images in sources:
+        start = time.perf_counter()
+        for image in images:
+            slideshow.decode_image(image, target_size)
+        emit('archive_decode', storage=storage, images=len(images),
+             seconds=round(time.perf_counter() - start, 4))
+
+
+def bench_load(paths):
+    target_size = slideshow.get_decode_target_size()
+    for path in paths:
+        for size_name, size in (('display', target_size), ('full', None)):
+            image, seconds = timed(slideshow.load_image, path, size)
+            if isinstance(image, slideshow.AnimationStream):
+                _, first_frame_seconds = timed(image.get_frame)
+                seconds += first_frame_seconds
+            emit('load', image=os.path.basename(path), size=size_name,
+                 width=image.width, height=image.height, seconds=round(seconds, 4))
+
+
+def bench_tiles(root, frames=300, pan=8):
+    # Build a panorama's tile pyramid, then pan across it at full size
+    if slideshow.PILImage is None:
+        print("Pillow isn't installed, skipping tiles", file=sys.stderr)
+        return
+
+    source = make_panorama(root)
+    path = os.path.join(root, 'panorama.tiles')
+    _, build_seconds = timed(slideshow.TilePyramid.build, source, path,
+                             slideshow.memory.budget)
+    pyramid = slideshow.TilePyramid(path)
+    pool = slideshow.TexturePool()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        tiles = slideshow.TiledSlide(pyramid, slideshow.window, executor, pool)
+        tiles.update(x=0, y=0, scale=1.0)
+        times = []
+        frames_loading = 0
+        for _ in range(frames):
+            start = time.perf_counter()
+            slideshow.window.clear()
+            frames_loading += tiles.draw()
+            times.append(time.perf_counter() - start)
+            tiles.update(x=tiles.x - pan)
+            # Give the readers a frame's time, as the event loop would
+            time.sleep(max(0, 1 / 60 - times[-1]))
+        tiles.delete()
+    pool.clear()
+
+    times.sort()
+    emit('tiles', width=pyramid.width, height=pyramid.height, levels=len(pyramid.levels),
+         build_seconds=round(build_seconds, 3),
+         frame_p50_microseconds=round(times[len(times) // 2] * 1e6, 1),
+         frame_p95_microseconds=round(times[int(len(times) * 0.95)] * 1e6, 1),
+         frames_loading=frames_loading)
+
+
+def timed_decode(paths, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as threads:
+        for _ in threads.map(slideshow.decode_image, paths):
+            pass
+    return time.perf_counter() - start
+
+
+def bench_decode_scaling(paths, repeat=4):
+    jobs = [path for path in paths if not path.endswith('gif')] * repeat
+    max_workers = os.cpu_count() or 2
+    worker_counts = sorted({count for count in (1, 2, 4, 8, 16, max_workers)
+                            if count <= max_workers})
+
+    for workers in worker_counts:
+        seconds = timed_decode(jobs, workers)
+        emit('decode_thread', workers=workers, images=len(jobs),
+             seconds=round(seconds, 3),
+             images_per_second=round(len(jobs) / seconds, 2))
+
+    for workers in worker_counts:
+        slideshow.decode_pool = slideshow.start_decode_pool(workers)
+        if slideshow.decode_pool is None:
+            return
+        try:
+            if workers == worker_counts[0]:
+                check_shared_decode(paths)
+            seconds = timed_decode(jobs, workers)
+        finally:
+            slideshow.decode_pool.shutdown()
+            slideshow.decode_pool = None
+        emit('decode_process', workers=workers, images=len(jobs),
+             seconds=round(seconds, 3),
+             images_per_second=round(len(jobs) / seconds, 2))
+
+
+def check_shared_decode(paths, target_size=(640, 360)):
+    # What comes back from a decode_pool worker through shared memory is
+    # the same image as decoding it here, at full and at display size
+    for path in paths:
+        if path.endswith('gif'):
+            continue
+        for size in (None, target_size):
+            width, height, fmt, pitch, data, full_width, full_height = \
+                slideshow.read_reduced_pixels(path, size) or slideshow.read_pixels(path)
+            image = slideshow.decode_still_image(path, size)
+            check(getattr(image, 'shared_memory', None) is not None,
+                  f"{path} at {size} wasn't decoded in the pool")
+            check((image.width, image.height, image.full_width, image.full_height)
+                  == (width, height, full_width, full_height),
+                  f"{path} at {size} came back {image.width}x{image.height}, not {width}x{height}")
+            check(bytes(image.get_data(fmt, pitch)) == bytes(data),
+                  f"{path} at {size} came back with different pixels")
+
+
+def synthetic_paths(count, per_directory=1000):
+    for index in range(count):
+        yield f"/photos/{index // per_directory:06d}/IMG_{index:08d}.jpg"
+
+
+def playlist_bytes(playlist):
+    return (sys.getsizeof(playlist._names)
+            + sys.getsizeof(playlist._name_ends)
+            + sys.getsizeof(playlist._directory_of)
+            + sum(sys.getsizeof(directory) for directory in playlist.directories)
+            + (sys.getsizeof(playlist.order) if playlist.order is not None else 0))
+
+
+def list_bytes(count):
+    # The old model: a list of path strings plus its saved_image_paths copy
+    return (2 * sys.getsizeof([None] * count)
+            + sum(sys.getsizeof(path) for path in synthetic_paths(count)))
+
+
+def bench_playlist(count):
+    start = time.perf_counter()
+    playlist = slideshow.Playlist(synthetic_paths(count))
+    build_seconds = time.perf_counter() - start
+    row = count // 2
+
+    start = time.perf_counter()
+    playlist.shuffle()
+    shuffle_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for position in range(10000):
+        playlist.row(position)
+    random_step_seconds = (time.perf_counter() - start) / 10000
+
+    start = time.perf_counter()
+    position = playlist.position(row)
+    position_seconds = time.perf_counter() - start
+
+    order = array.array('I', reversed(range(count)))
+    start = time.perf_counter()
+    playlist.set_order(order)
+    position = playlist.position(row)
+    sort_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    playlist.reset_order()
+    position = playlist.position(row)
+    restore_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for position in range(0, count, max(1, count // 10000)):
+        playlist[position]
+    lookups = len(range(0, count, max(1, count // 10000)))
+    lookup_seconds = time.perf_counter() - start
+
+    emit('playlist', entries=count,
+         build_seconds=round(build_seconds, 3),
+         bytes=playlist_bytes(playlist),
+         list_bytes=list_bytes(count),
+         shuffle_seconds=round(shuffle_seconds, 6),
+         random_step_microseconds=round(random_step_seconds * 1e6, 3),
+         position_seconds=round(position_seconds, 6),
+         sort_seconds=round(sort_seconds, 6),
+         restore_seconds=round(restore_seconds, 6),
+         lookup_microseconds=round(lookup_seconds / lookups * 1e6, 3))
+
+
+def bench_session(root, count):
+    # Saving a session as it plays, and reading it back to resume from
+    playlist = slideshow.Playlist(synthetic_paths(count))
+    playlist.shuffle()
+    session = slideshow.Session(os.path.join(root, f"session{count}"))
+    start = time.perf_counter()
+    session.save(playlist, 0, 6.0, True, True)
+    save_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in range(1, 1001):
+        session.save(playlist, row, 6.0, True, True)
+    state_seconds = (time.perf_counter() - start) / 1000
+
+    playlist.extend(synthetic_paths(1000))
+    start = time.perf_counter()
+    session.save(playlist, 0, 6.0, True, True)
+    append_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resumed = slideshow.Session(session.path).load()
+    load_seconds = time.perf_counter() - start
+    assert len(resumed[0]) == len(playlist)
+    emit('session', entries=count,
+         bytes=os.path.getsize(session.path + '.playlist'),
+         save_seconds=round(save_seconds, 4),
+         state_microseconds=round(state_seconds * 1e6, 1),
+         append_seconds=round(append_seconds, 4),
+         load_seconds=round(load_seconds, 4))
+
+
+def draw_frame():
+    slideshow.animate_slides(0)
+    slideshow.on_draw()
+
+
+def setup_show(paths):
+    slideshow.image_paths = slideshow.Playlist(paths)
+    slideshow.image_filename = slideshow.image_paths[slideshow.image_index]
+    slideshow.img = slideshow.load_image(slideshow.image_filename,
+                                         slideshow.get_decode_target_size())
+    slideshow.create_slides()
+    slideshow.show_image(slideshow.img)
+    slideshow.create_overlay()
+    slideshow.show_progress_bar()
+
+
+def bench_draw(frames=600):
+    for ken_burns in (False, True):
+        slideshow.ken_burns = ken_burns
+        slideshow.setup_slide()
+        for _ in range(30):
+            draw_frame()
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            draw_frame()
+        frame_seconds = (time.perf_counter() - start) / frames
+
+        # Peak is what a frame allocates on top of what's already live,
+        # retained is what it leaves behind
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for _ in range(frames):
+            draw_frame()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        retained = (current - baseline) / frames
+        emit('draw', ken_burns=ken_burns, frames=frames,
+             frame_microseconds=round(frame_seconds * 1e6, 1),
+             peak_bytes=peak - baseline,
+             retained_bytes_per_frame=round(retained, 1))
+        check(peak - baseline <= MAX_DRAW_PEAK_BYTES,
+              f"draw (ken_burns={ken_burns}) allocated {peak - baseline} bytes at once, "
+              f"more than {MAX_DRAW_PEAK_BYTES}")
+        check(retained <= MAX_DRAW_RETAINED_BYTES_PER_FRAME,
+              f"draw (ken_burns={ken_burns}) kept {retained:.1f} bytes a frame, "
+              f"more than {MAX_DRAW_RETAINED_BYTES_PER_FRAME}")
+
+
+def bench_idle(seconds=3):
+    # A paused, still slide: how often the loop wakes and what it costs
+    slideshow.ken_burns = False
+    slideshow.setup_slide()
+    for on_demand in (False, True):
+        event_loop = slideshow.IdleEventLoop(on_demand)
+        slideshow.event_loop = pyglet.app.event_loop = event_loop
+        pyglet.clock.schedule_once(lambda dt: event_loop.exit(), seconds)
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        event_loop.run(slideshow.frame_interval)
+        elapsed = time.perf_counter() - start
+
+        emit('idle', on_demand=on_demand,
+             wakeups_per_second=round(event_loop.wakeups / elapsed, 1),
+             cpu_percent=round(100 * (time.process_time() - cpu_start) / elapsed, 1))
+    slideshow.event_loop = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image_dirs', nargs='*', default=default_image_dirs)
+    parser.add_argument('--only', default=','.join(BENCHMARKS))
+    parser.add_argument('--tree-sizes', default='10000')
+    parser.add_argument('--list-sizes', default='10000,1000000')
+    parser.add_argument('--playlist-sizes', default='1000000,10000000')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--save-baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    only = args.only.split(',')
+    tree_sizes = [int(count) for count in args.tree_sizes.split(',')]
+    list_sizes = [int(count) for count in args.list_sizes.split(',')]
+
+    paths = []
+    for image_dir in args.image_dirs:
+        paths.extend(slideshow.get_image_paths_from_directory(image_dir))
+
+    fixtures = tempfile.mkdtemp(prefix='slideshow-benchmark-')
+    try:
+        if 'discovery' in only:
+            for count in tree_sizes:
+                bench_discovery(fixtures, count)
+
+        if 'playlist_file' in only:
+            for count in list_sizes:
+                bench_playlist_file(fixtures, count)
+
+        if 'stdin' in only:
+            for count in list_sizes:
+                bench_stdin(count)
+
+        if 'playlist' in only:
+            for count in args.playlist_sizes.split(','):
+                bench_playlist(int(count))
+
+        if 'session' in only:
+            for count in args.playlist_sizes.split(','):
+                bench_session(fixtures, int(count))
+
+        if 'sort' in only:
+            for count in tree_sizes:
+                bench_sort(fixtures, count)
+
+        if 'probe' in only:
+            for count in tree_sizes:
+                bench_probe(fixtures, count)
+
+        if 'archive' in only:
+            for count in tree_sizes:
+                bench_archive(fixtures, count, paths)
+
+        if 'decode' in only:
+            bench_decode_scaling(paths)
+
+        if 'load' in only:
+            bench_load(make_large_images(fixtures))
+
+        if 'tiles' in only:
+            bench_tiles(fixtures)
+
+        if 'draw' in only or 'idle' in only:
+            setup_show(paths)
+        if 'draw' in only:
+            bench_draw()
+        if 'idle' in only:
+            bench_idle()
+    finally:
+        shutil.rmtree(fixtures, ignore_errors=True)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline)
+    if args.baseline and not compare_with_baseline(args.baseline, args.tolerance):
+        sys.exit(1)
+    if failures:
+        sys.exit(1)
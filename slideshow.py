@@ -4,14 +4,76 @@
 # Licenced under GPL v3 see LICENSE
 # See README.md for more info
 
+import io
 import os
 import sys
+import mmap
+import time
+import queue
+import array
+import bisect
+import ctypes
+import ctypes.util
+import struct
+import errno
 import random
+import fnmatch
+import json
+import zlib
+import tarfile
+import zipfile
+import posixpath
+import hashlib
+import argparse
+import tempfile
+import weakref
+import threading
+import multiprocessing
 import pyglet
 import pyperclip
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+# Exports render offscreen, and don't need a display
+if __name__ == '__main__' and any(arg.startswith('--export') for arg in sys.argv[1:]):
+    pyglet.options['headless'] = True
 
 SLIDESHOW_EXTENSION = '.slideshow'
-IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'bmp', 'dds', 'exif', 'jp2', 'jpx', 'pcx', 'pnm', 'ras', 'tga', 'tif', 'tiff', 'xbm', 'xpm')
+# Uncompressed tars only, their members are read in place like a zip's
+ARCHIVE_EXTENSIONS = ('.zip', '.tar')
+PLAYLIST_INDEX_HEADER = struct.Struct('<4sHII')
+PLAYLIST_INDEX_DEPENDENCY = struct.Struct('<qI')
+PLAYLIST_INDEX_MAGIC = b'SSPL'
+PLAYLIST_INDEX_VERSION = 1
+SESSION_PLAYLIST_HEADER = struct.Struct('<4sH')
+SESSION_PLAYLIST_MAGIC = b'SSSP'
+SESSION_CHUNK = struct.Struct('<IIQI') # rows, directories size, names size, crc32
+SESSION_ORDER_HEADER = struct.Struct('<4sHI')
+SESSION_ORDER_MAGIC = b'SSSO'
+SESSION_STATE = struct.Struct('<4sHBxdQI') # flags, interval, row, seed size
+SESSION_STATE_MAGIC = b'SSST'
+SESSION_VERSION = 1
+SESSION_KEN_BURNS = 1
+SESSION_RANDOM = 2
+SESSION_SHUFFLED = 4
+SESSION_SORTED = 8
+# Formats probe_image can read the header of
+PROBED_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp')
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'bmp', 'dds', 'exif', 'jp2', 'jpx', 'pcx', 'pnm', 'ras', 'tga', 'tif', 'tiff', 'webp', 'xbm', 'xpm')
+# What a broken or truncated file raises while it's decoded
+DECODE_ERRORS = (OSError, ValueError, SyntaxError, pyglet.image.codecs.ImageDecodeException)
+if PILImage is not None:
+    # Or one too big to decode
+    DECODE_ERRORS += (PILImage.DecompressionBombError,)
+ANIMATION_EXTENSIONS = ('gif', 'png', 'webp')
+PIL_ONLY_EXTENSIONS = ('webp',)
 
 help_osd = """
 Slideshow Controls (v2.0)
@@ -22,7 +84,10 @@ Q     - Quit (also Esc)                k   - Ken Burns effect toggle
 [,]   - Change image delay time        i   - Copy filename to clipboard
 1-9   - Change image delay time        o,n - Oldest/newest order
 f     - Maximize window                a,z - Alphabetical/reverse order
-r     - Random/selection order toggle  ← → - Prev/next image
+r     - Random/selection order toggle  c,v - Oldest/newest photo taken
+← →   - Prev/next image                t   - Texture memory in use
+                                       p   - Performance stats toggle
+                                       m   - Memory in use
 
 Mouse:
 Left Click left or right side - Prev/next image
@@ -35,13 +100,50 @@ Slideshow will look for valid image filenames in stdin,
 or from a directory and display them.
 
 Usage:
-    slideshow [filename.slideshow]
+    slideshow [options] [filename.slideshow]
 or
-    slideshow [directory]
+    slideshow [options] [directory]
 or
-    slideshow < list_of_filenames_via_stdin
+    slideshow [options] [archive.zip|archive.tar]
 or
-    image_filenames_pipe_source | slideshow
+    slideshow [options] < list_of_filenames_via_stdin
+or
+    image_filenames_pipe_source | slideshow [options]
+
+Options:
+  --decoder thread|process - decode images in threads (default)
+                             or in a process pool using all cores
+  --workers N - number of decode workers
+  --full-resolution - always decode images at full size, instead of
+                      at the size they're displayed (needs Pillow)
+  --disk-cache - keep decoded images in a cache directory between runs
+                 (display size only, not with --full-resolution)
+  --cache-dir DIR - use DIR for the disk cache (implies --disk-cache)
+  --cache-size MB - disk cache size limit
+  --warm-cache - decode every image into the disk cache and exit
+  --transition none|crossfade|slide|zoom - how slides change
+  --transition-time SECONDS - how long a transition takes
+  --idle - only redraw when something changes, to save power
+  --memory-budget MB - limit for decoded images and textures together
+                       (default 1024), decodes get smaller to stay in it
+  --metrics FILE - write performance metrics as JSON lines to FILE,
+                   or to stderr with -
+  --export DIR - render the slideshow offscreen, as fast as possible, to
+                 numbered PNGs in DIR, or raw RGB frames on stdout with -
+  --export-size WxH - exported frame size (default 1920x1080)
+  --export-fps N - exported frames per second (default 30)
+  --export-duration SECONDS - how much to export (default: every slide once)
+  --random - start in random order
+  --seed N - repeatable random order
+  -R, --recursive - include images in sub directories
+  --max-depth N - don't recurse deeper than N directories
+  --include GLOB - only show files matching GLOB (repeatable)
+  --exclude GLOB - skip files and directories matching GLOB (repeatable)
+  --watch - follow images being added, changed, renamed and deleted in
+            the directory while the slideshow runs
+  --resume - save the session as it plays, and carry on where the last
+             --resume run of the same directory or file source left off,
+             catching up with changes to the source in the background
 
 Keyboard Controls:
   Esc,q - quit
@@ -51,6 +153,12 @@ Keyboard Controls:
   r - random toggle
   k - Ken Burns effect toggle
   i - Copy image filename to clipboard
+  t - show texture memory in use
+  p - performance stats toggle
+  m - show memory in use against the budget
+  a, z - sort alphabetically / reverse
+  o, n - sort by date created, oldest / newest
+  c, v - sort by date taken (EXIF), oldest / newest
   SPACE - pause/resume
   left, right - move between images
 
@@ -75,7 +183,7 @@ class ShadowLabel:
                  opacity=255, color=(255,255,255,255), shadow_color=(0,0,0,127),
                  offset_x=2, offset_y=-2,
                  anchor_x='center', anchor_y='center',
-                 multiline=False, width=None):
+                 multiline=False, width=None, batch=None, group=None):
         self._x = x
         self._offset_x = offset_x
         self._y = y
@@ -92,7 +200,9 @@ class ShadowLabel:
             anchor_y = anchor_y,
             color = color,
             multiline = multiline,
-            width = width
+            width = width,
+            batch = batch,
+            group = pyglet.graphics.Group(order=1, parent=group)
         )
         self.shadow_label = pyglet.text.Label(
             self._text,
@@ -104,8 +214,11 @@ class ShadowLabel:
             anchor_y = anchor_y,
             color=shadow_color,
             multiline = multiline,
-            width = width
+            width = width,
+            batch = batch,
+            group = pyglet.graphics.Group(order=0, parent=group)
         )
+        self.opacity = opacity
 
     def show(self, message):
         self.text = message
@@ -121,8 +234,13 @@ class ShadowLabel:
     @opacity.setter
     def opacity(self, value):
         self._opacity = value
-        self.main_label.opacity = value
-        self.shadow_label.opacity = value
+        # Hidden labels drop their vertices, so they cost nothing to draw,
+        # and only catch up with the text when shown again
+        for label in (self.main_label, self.shadow_label):
+            label.visible = value > 0
+            if value > 0:
+                label.text = self._text
+                label.opacity = value
 
     @property
     def text(self):
@@ -131,8 +249,9 @@ class ShadowLabel:
     @text.setter
     def text(self, value):
         self._text = value
-        self.main_label.text = value
-        self.shadow_label.text = value
+        if self._opacity > 0:
+            self.main_label.text = value
+            self.shadow_label.text = value
 
     @property
     def x(self):
@@ -159,30 +278,2118 @@ class ShadowLabel:
         self.main_label.draw()
 
 
+class ImageCache:
+    # Decoded images, within what memory leaves for them
+    def __init__(self, memory):
+        self.memory = memory
+        memory.cache = self
+        self.size = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, image):
+        nbytes = get_image_bytes(image)
+        pressure = False
+        with self._lock:
+            if key in self._images:
+                self.size -= self._images.pop(key)[1]
+            self._images[key] = (image, nbytes)
+            self.size += nbytes
+            # Always keep the newest image, even when it alone is over budget
+            while self.size > self.memory.get_cache_budget() and len(self._images) > 1:
+                victim, wanted = self.memory.choose_victim(self._images, key)
+                self.size -= self._images.pop(victim)[1]
+                self.memory.evictions += 1
+                pressure = pressure or wanted
+            pressure = pressure or self.size > self.memory.get_cache_budget()
+        if pressure:
+            self.memory.degrade()
+
+    def discard(self, filename):
+        with self._lock:
+            for key in [key for key in self._images if key[0] == filename]:
+                self.size -= self._images.pop(key)[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+
+class DiskCache:
+    # Blob: header then raw pixel rows exactly as pyglet ImageData holds them
+    header = struct.Struct('<4sHHIIiII8s')
+    magic = b'SSPX'
+    version = 1
+
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _blob_path(self, filename, target_size):
+        stat = stat_image(filename)
+        key = f"{filename}\0{stat.st_size}\0{stat.st_mtime_ns}\0{target_size[0]}x{target_size[1]}"
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.pixels')
+
+    def get(self, filename, target_size):
+        path = self._blob_path(filename, target_size)
+        try:
+            with open(path, 'rb') as file:
+                # Copy-on-write so ctypes can view it, pages stay shared with the page cache
+                blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        if len(blob) < self.header.size:
+            return None
+        magic, version, _, width, height, pitch, full_width, full_height, fmt = \
+            self.header.unpack_from(blob)
+        size = abs(pitch) * height
+        if magic != self.magic or version != self.version or len(blob) < self.header.size + size:
+            return None
+
+        pixels = (ctypes.c_ubyte * size).from_buffer(blob, self.header.size)
+        image = make_image_data(width, height, fmt.rstrip(b'\0').decode('ascii'),
+                                pitch, pixels, full_width, full_height)
+        image.blob = blob
+        return image
+
+    def put(self, filename, target_size, image):
+        if not isinstance(image, pyglet.image.ImageData):
+            return
+
+        path = self._blob_path(filename, target_size)
+        data = image.get_data(image.format, image.pitch)
+        full_width, full_height = get_full_width_height(image)
+        header = self.header.pack(self.magic, self.version, 0, image.width, image.height,
+                                  image.pitch, full_width, full_height,
+                                  image.format.encode('ascii'))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a private temp file and rename, so readers and other
+        # writers only ever see complete blobs
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(header)
+                file.write(memoryview(data).cast('B'))
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._written += len(header) + len(data)
+            evict = self._written > self.budget // 16
+            if evict:
+                self._written = 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        blobs = []
+        total = 0
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith('.tmp-'):
+                    # Left behind by a writer that died
+                    if now - stat.st_mtime > 3600:
+                        self._remove(path)
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.budget:
+            return
+
+        # Oldest first, down to 90% so we don't evict on every write
+        blobs.sort()
+        for _, size, path in blobs:
+            if total <= self.budget * 0.9:
+                break
+            if self._remove(path):
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            # Another slideshow evicted it first
+            return False
+
+
+class ArchiveIndex:
+    # The images in a zip or an uncompressed tar, in the order their data
+    # is laid out in the archive: where each member's data starts, its size
+    # there and unpacked, and whether it's deflated. Read from the zip
+    # central directory or the tar headers once, then from a copy cached
+    # until the archive changes. Members are read from an mmap of the archive.
+    header = struct.Struct('<4sHI')
+    zip_local_header = struct.Struct('<4s22xHH')
+    magic = b'SSAR'
+    version = 1
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.stat = stat
+        self.names = []
+        self.offsets = array.array('Q')
+        self.compressed_sizes = array.array('Q')
+        self.sizes = array.array('Q')
+        self.deflated = bytearray()
+        index_path = get_archive_index_path(path, stat)
+        if not self._read_index(index_path):
+            self._scan()
+            self._write_index(index_path)
+        self._rows = {name: row for row, name in enumerate(self.names)}
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open(self, name):
+        row = self._rows.get(name)
+        if row is None:
+            raise FileNotFoundError(errno.ENOENT, f"No {name} in", self.path)
+        start = self.offsets[row]
+        data = memoryview(self._map)[start:start + self.compressed_sizes[row]]
+        return ArchiveMember(data, self.sizes[row], self.deflated[row])
+
+    def get_offset(self, name):
+        row = self._rows.get(name)
+        return 0 if row is None else self.offsets[row]
+
+    def will_need(self, name):
+        # Starts the kernel reading the member in, ahead of its decode
+        row = self._rows.get(name)
+        if row is None or not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        start = self.offsets[row] - self.offsets[row] % mmap.PAGESIZE
+        length = self.offsets[row] + self.compressed_sizes[row] - start
+        if length:
+            self._map.madvise(mmap.MADV_WILLNEED, start, length)
+
+    def _scan(self):
+        if self.path.endswith('.zip'):
+            members = self._scan_zip()
+        else:
+            members = self._scan_tar()
+        for name, offset, compressed_size, size, deflated in sorted(members, key=lambda member: member[1]):
+            self.names.append(name)
+            self.offsets.append(offset)
+            self.compressed_sizes.append(compressed_size)
+            self.sizes.append(size)
+            self.deflated.append(deflated)
+
+    def _scan_zip(self):
+        members = []
+        skipped = 0
+        with zipfile.ZipFile(self.path) as archive:
+            for info in archive.infolist():
+                name = self._get_member_name(info.filename)
+                if info.is_dir() or name is None:
+                    continue
+                if info.flag_bits & 1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    # Encrypted, or packed some way there's no streaming inflate here for
+                    skipped += 1
+                    continue
+                # The data follows the local header, whose extra field can
+                # differ from the central directory's
+                archive.fp.seek(info.header_offset)
+                magic, name_size, extra_size = self.zip_local_header.unpack(
+                    archive.fp.read(self.zip_local_header.size))
+                if magic != b'PK\x03\x04':
+                    raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+                offset = info.header_offset + self.zip_local_header.size + name_size + extra_size
+                members.append((name, offset, info.compress_size, info.file_size,
+                                info.compress_type == zipfile.ZIP_DEFLATED))
+        if skipped:
+            print(f"Skipping {skipped} encrypted or bzip2/lzma members of {self.path}", file=sys.stderr)
+        return members
+
+    def _scan_tar(self):
+        members = []
+        # 'r:' only, a compressed tar can't be read from the middle
+        with tarfile.open(self.path, 'r:') as archive:
+            for info in archive:
+                name = self._get_member_name(info.name)
+                if info.isfile() and not info.issparse() and name is not None:
+                    members.append((name, info.offset_data, info.size, info.size, False))
+        return members
+
+    def _get_member_name(self, name):
+        # None for names that aren't images, or would point outside the archive
+        name = posixpath.normpath(name)
+        if name.startswith(('/', '../')) or name == '..' or not name.endswith(IMAGE_EXTENSIONS):
+            return None
+        return name
+
+    def _read_index(self, index_path):
+        try:
+            with open(index_path, 'rb') as file:
+                data = file.read()
+            magic, version, count = self.header.unpack_from(data)
+        except (OSError, struct.error):
+            return False
+        if magic != self.magic or version != self.version:
+            return False
+
+        offset = self.header.size
+        columns = []
+        for _ in range(3):
+            columns.append(array.array('Q', data[offset:offset + count * 8]))
+            offset += count * 8
+        deflated = bytearray(data[offset:offset + count])
+        offset += count
+        names = data[offset:].decode('utf-8', 'surrogateescape').split('\0') if count else []
+        if len(names) != count or any(len(column) != count for column in columns) or len(deflated) != count:
+            return False
+        self.names = names
+        self.offsets, self.compressed_sizes, self.sizes = columns
+        self.deflated = deflated
+        return True
+
+    def _write_index(self, index_path):
+        names = '\0'.join(self.names).encode('utf-8', 'surrogateescape')
+        data = b''.join((self.header.pack(self.magic, self.version, len(self.names)),
+                         self.offsets.tobytes(), self.compressed_sizes.tobytes(),
+                         self.sizes.tobytes(), bytes(self.deflated), names))
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix='.tmp-')
+        except OSError:
+            # Indexed again next time
+            return
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, index_path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+
+class ArchiveMember(io.RawIOBase):
+    # A read only file over one member's bytes in an archive's mmap. Stored
+    # members are read in place; deflated ones are inflated as far as reads
+    # reach, so probing a header unpacks just the start of the member.
+    def __init__(self, data, size, deflated):
+        self._size = size
+        self._position = 0
+        self._packed = data
+        self._unpacked_from = 0
+        if deflated:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            self._data = bytearray()
+        else:
+            self._inflater = None
+            self._data = data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        end = min(self._position + len(buffer), self._size)
+        if self._inflater is not None:
+            self._inflate(end)
+        count = max(0, min(end, len(self._data)) - self._position)
+        buffer[:count] = self._data[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def _inflate(self, end):
+        while len(self._data) < end and self._unpacked_from < len(self._packed):
+            chunk = self._packed[self._unpacked_from:self._unpacked_from + 256 * 1024]
+            self._unpacked_from += len(chunk)
+            try:
+                self._data += self._inflater.decompress(chunk)
+            except zlib.error as e:
+                # Reported like any other broken file
+                raise OSError(f"Can't inflate: {e}")
+
+    def close(self):
+        super().close()
+        self._packed = self._data = b''
+
+
+class RandomOrder:
+    # A seeded shuffle of [0, count) that's never materialised. Rows added
+    # later get a segment of their own after the others, covering the same
+    # span of positions as of rows, so positions already played never
+    # change; merge() then shuffles every position from the one given on
+    # again, so the new rows mix with everything still to come. Segments
+    # and merges are each a Feistel network over the smallest even power
+    # of two domain covering them, values outside it are walked on through
+    # it until they land inside.
+    # Used as a Playlist order, it works like the array('I') it stands in for.
+    rounds = 4
+
+    def __init__(self, count, seed, starts=None, merges=None):
+        self.seed = seed
+        self.count = count
+        # First position (and row) of each segment
+        self.starts = array.array('I', [0]) if starts is None else starts
+        # Each merge shuffles positions [merge_starts[i], merge_ends[i]),
+        # the count when it was made
+        self.merge_starts = array.array('I') if merges is None else merges[0]
+        self.merge_ends = array.array('I') if merges is None else merges[1]
+        self._keys = {}
+
+    @classmethod
+    def from_state(cls, count, seed, state):
+        # From get_state(), None if it doesn't fit count rows
+        if not state or len(state) < state[0] + 1 or (len(state) - state[0] - 1) % 2:
+            return None
+        starts = state[1:state[0] + 1]
+        merge_starts, merge_ends = state[state[0] + 1::2], state[state[0] + 2::2]
+        if (not starts or starts[0] != 0 or starts[-1] >= count
+                or any(a >= b for a, b in zip(starts, starts[1:]))
+                or any(start >= end or end > count for start, end in zip(merge_starts, merge_ends))
+                or any(a > b for a, b in zip(merge_ends, merge_ends[1:]))):
+            return None
+        return cls(count, seed, starts, (merge_starts, merge_ends))
+
+    def get_state(self):
+        # The segment starts and merges, as one array('I') for a session
+        state = array.array('I', [len(self.starts)])
+        state.extend(self.starts)
+        for start, end in zip(self.merge_starts, self.merge_ends):
+            state.extend((start, end))
+        return state
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        # Through the merges latest first, down to the ones made before the
+        # segment it's in now was added, then look it up in that segment
+        for merge in range(len(self.merge_ends) - 1, -1, -1):
+            start, end = self.merge_starts[merge], self.merge_ends[merge]
+            if position >= end:
+                break
+            if position >= start:
+                position = start + self._walk(position - start, end - start, ('merge', start, end), False)
+        return self._walk_segment(position, False)
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self[position]
+
+    def index(self, row):
+        if not 0 <= row < self.count:
+            raise ValueError(row)
+        position = self._walk_segment(row, True)
+        for merge in range(bisect.bisect_right(self.merge_ends, position), len(self.merge_ends)):
+            start, end = self.merge_starts[merge], self.merge_ends[merge]
+            if position >= start:
+                position = start + self._walk(position - start, end - start, ('merge', start, end), True)
+        return position
+
+    def extend(self, rows):
+        if len(rows) and self.count:
+            self.starts.append(self.count)
+        self.count += len(rows)
+
+    def merge(self, position):
+        # Shuffles everything from position on together, how rows just
+        # added join the rest still to come. Later merges from at or after
+        # position only moved positions this one shuffles anyway, so they go.
+        while self.merge_starts and self.merge_starts[-1] >= position:
+            self.merge_starts.pop()
+            self.merge_ends.pop()
+        if position < self.count - 1:
+            self.merge_starts.append(position)
+            self.merge_ends.append(self.count)
+
+    def _walk_segment(self, value, inverse):
+        segment = bisect.bisect_right(self.starts, value) - 1
+        start = self.starts[segment]
+        end = self.starts[segment + 1] if segment + 1 < len(self.starts) else self.count
+        return start + self._walk(value - start, end - start, start, inverse)
+
+    def _walk(self, value, size, domain, inverse):
+        value = self._permute(value, size, domain, inverse)
+        while value >= size:
+            value = self._permute(value, size, domain, inverse)
+        return value
+
+    def _permute(self, value, size, domain, inverse):
+        # Feistel rounds; run with the keys reversed, on the halves swapped,
+        # they undo each other
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        keys = self._keys.get((domain, bits))
+        if keys is None:
+            # A segment's domain is its start, a merge's ('merge', start, end)
+            name = domain if isinstance(domain, int) else ':'.join(map(str, domain))
+            generator = random.Random(f"{self.seed}:{name}:{bits}")
+            keys = [generator.getrandbits(32) for _ in range(self.rounds)]
+            self._keys[domain, bits] = keys
+        half = bits // 2
+        mask = (1 << half) - 1
+        left, right = value >> half, value & mask
+        if inverse:
+            keys = keys[::-1]
+            left, right = right, left
+        for key in keys:
+            mixed = ((right ^ key) * 0x45d9f3b) & 0xffffffff
+            mixed ^= mixed >> 16
+            left, right = right, left ^ (mixed & mask)
+        if inverse:
+            left, right = right, left
+        return (left << half) | right
+
+
+class Playlist:
+    # Each path is stored once, as an interned directory id and the name's
+    # bytes in one shared buffer. Rows are numbered in the order paths were
+    # added; the play order is an array('I') of rows (None while it's the
+    # same as the rows) with an inverse from row back to position. Rows are
+    # never renumbered, a path that goes away is marked removed and skipped.
+    def __init__(self, paths=()):
+        self.directories = []
+        self._directory_ids = {}
+        self._directory_of = array.array('I')
+        self._names = bytearray()
+        self._name_ends = array.array('Q')
+        self._directory_rows = None
+        self.removed = set()
+        self.order = None
+        self._positions = None
+        self.extend(paths)
+
+    def __len__(self):
+        return len(self._directory_of)
+
+    def __getitem__(self, position):
+        return self.path(self.row(position))
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def path(self, row):
+        name = os.fsdecode(self._name(row))
+        return os.path.join(self.directories[self._directory_of[row]], name)
+
+    def _name(self, row):
+        start = self._name_ends[row - 1] if row else 0
+        return bytes(self._names[start:self._name_ends[row]])
+
+    def paths(self, start, stop):
+        return [self.path(row) for row in range(start, min(stop, len(self)))]
+
+    def row(self, position):
+        return position if self.order is None else self.order[position]
+
+    def position(self, row):
+        if self.order is None:
+            return row
+        if self._positions is None:
+            # A single lookup is cheaper as a C scan than building the inverse
+            return self.order.index(row)
+        return self._positions[row]
+
+    def find(self, path):
+        # Rows holding path, usually one
+        directory, name = os.path.split(path)
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            return []
+        name = os.fsencode(name)
+        return [row for row in self._get_directory_rows().get(directory_id, ())
+                if self._name(row) == name]
+
+    def find_under(self, directory):
+        # Rows of every path in directory and below it
+        prefix = os.path.join(directory, '')
+        directory_rows = self._get_directory_rows()
+        rows = []
+        for directory_id, name in enumerate(self.directories):
+            if name == directory or name.startswith(prefix):
+                rows.extend(directory_rows.get(directory_id, ()))
+        return rows
+
+    def _get_directory_rows(self):
+        # Built on the first lookup, so only watched playlists pay for it
+        if self._directory_rows is None:
+            directory_rows = {}
+            for row, directory_id in enumerate(self._directory_of):
+                directory_rows.setdefault(directory_id, array.array('I')).append(row)
+            self._directory_rows = directory_rows
+        return self._directory_rows
+
+    def is_removed(self, row):
+        return row in self.removed
+
+    def remove(self, row):
+        self.removed.add(row)
+
+    def restore(self, row):
+        self.removed.discard(row)
+
+    def extend(self, paths):
+        first = len(self)
+        for path in paths:
+            directory, name = os.path.split(path)
+            directory_id = self._directory_ids.get(directory)
+            if directory_id is None:
+                directory_id = len(self.directories)
+                self._directory_ids[directory] = directory_id
+                self.directories.append(directory)
+            self._names += os.fsencode(name)
+            self._name_ends.append(len(self._names))
+            if self._directory_rows is not None:
+                self._directory_rows.setdefault(directory_id, array.array('I')).append(len(self))
+            # Last, readers on other threads go by this length
+            self._directory_of.append(directory_id)
+        self._extend_order(first)
+
+    def get_chunk(self, first_row, first_directory):
+        # The stored columns from first_row and first_directory on
+        start = self._name_ends[first_row - 1] if first_row else 0
+        return (self.directories[first_directory:], self._directory_of[first_row:],
+                self._name_ends[first_row:], bytes(self._names[start:]))
+
+    def extend_chunk(self, directories, directory_of, name_ends, names):
+        # Appends what get_chunk returned, without splitting any paths
+        first = len(self)
+        for directory in directories:
+            self._directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        self._names += names
+        self._name_ends.extend(name_ends)
+        self._directory_rows = None
+        self._directory_of.extend(directory_of)
+        self._extend_order(first)
+
+    def get_directory_names(self, directory):
+        # {name: [rows]} for a directory, to look up many of its names at once
+        directory_id = self._directory_ids.get(directory)
+        names = {}
+        if directory_id is not None:
+            for row in self._get_directory_rows().get(directory_id, ()):
+                names.setdefault(os.fsdecode(self._name(row)), []).append(row)
+        return names
+
+    def _extend_order(self, first):
+        if self.order is not None:
+            self.order.extend(range(first, len(self)))
+            if self._positions is not None:
+                self._positions.extend(range(first, len(self)))
+
+    def set_order(self, order):
+        if isinstance(order, array.array):
+            # Ours to grow and scatter, callers may keep theirs (sort caches)
+            order = array.array('I', order)
+        self.order = order
+        self._positions = None
+
+    def reset_order(self):
+        self.set_order(None)
+
+    def shuffle(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.set_order(RandomOrder(len(self), seed))
+
+    def scatter(self, first_position, start):
+        # Move each position from first_position on to a random place at or
+        # after start, how new paths join a shuffled playlist
+        if isinstance(self.order, RandomOrder):
+            self.order.merge(start)
+            return
+        if self.order is None:
+            self.set_order(array.array('I', range(len(self))))
+        positions = self.get_positions()
+        for position in range(first_position, len(self)):
+            other = random.randint(min(start, position), position)
+            row, other_row = self.order[position], self.order[other]
+            self.order[position], self.order[other] = other_row, row
+            positions[row], positions[other_row] = other, position
+
+    def get_positions(self):
+        if self._positions is None:
+            positions = array.array('I', bytes(4 * len(self)))
+            for position, row in enumerate(self.order):
+                positions[row] = position
+            self._positions = positions
+        return self._positions
+
+
+class AnimationStream:
+    # An animated GIF/PNG/WebP decoded a few frames ahead of playback on a
+    # background thread, so memory doesn't grow with the number of frames.
+    # width and height are the canvas size from the header.
+    def __init__(self, filename, frames_ahead=8):
+        with open_pil_image(filename) as image:
+            self.width, self.height = image.size
+        self.filename = filename
+        self.nbytes = (frames_ahead + 1) * self.width * self.height * 4
+        self._frames = queue.Queue(maxsize=frames_ahead)
+        self._frame = None
+        self._show_frame = None
+        # The decoder only holds a weak reference, and stops once we're dropped
+        threading.Thread(target=decode_animation_frames,
+                         args=(filename, self._frames, weakref.ref(self)),
+                         name='animation', daemon=True).start()
+
+    def get_frame(self):
+        # Raises what the decoder ran into, if it couldn't get this far
+        if self._frame is None:
+            frame, duration = self._frames.get()
+            if frame is None:
+                self._frames.put((None, duration))
+                raise duration
+            self._frame = frame, duration
+        return self._frame[0]
+
+    def has_frame(self):
+        # Whether get_frame can return without waiting on the decoder
+        return self._frame is not None or not self._frames.empty()
+
+    def play(self, show_frame):
+        self._show_frame = show_frame
+        show_frame(self.get_frame())
+        pyglet.clock.schedule_once(self._next_frame, self._frame[1])
+
+    def stop(self):
+        pyglet.clock.unschedule(self._next_frame)
+        self._show_frame = None
+
+    def _next_frame(self, dt):
+        try:
+            self._frame = self._frames.get_nowait()
+        except queue.Empty:
+            # Decoder fell behind, hold this frame a little longer
+            pyglet.clock.schedule_once(self._next_frame, 0.01)
+            return
+        if self._frame[0] is None:
+            # A broken frame further in, the last good one stays up
+            print(f"Can't read {self.filename}: {self._frame[1]}", file=sys.stderr)
+            return
+        self._show_frame(self._frame[0])
+        pyglet.clock.schedule_once(self._next_frame, self._frame[1])
+
+
+class TexturePool:
+    # Slides draw from pooled GL textures instead of each image making its
+    # own. Textures are bucketed by size rounded up to size_step, new pixels
+    # are uploaded into a free one with glTexSubImage2D and the slide shows
+    # a region of it. Textures beyond max_idle are deleted straight away.
+    size_step = 64
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.live_textures = 0
+        self.live_bytes = 0
+        self.uploads = 0
+        self.reused = 0
+        self._idle = OrderedDict()
+
+    def acquire(self, image):
+        size = (-(-image.width // self.size_step) * self.size_step,
+                -(-image.height // self.size_step) * self.size_step)
+        idle = self._idle.get(size)
+        if idle:
+            texture = idle.pop()
+            if not idle:
+                del self._idle[size]
+            self.reused += 1
+        else:
+            texture = pyglet.image.Texture.create(*size, blank_data=False)
+            # The region's left and bottom edges sample its own pixels, not
+            # the far side of the texture
+            pyglet.gl.glBindTexture(texture.target, texture.id)
+            pyglet.gl.glTexParameteri(texture.target, pyglet.gl.GL_TEXTURE_WRAP_S, pyglet.gl.GL_CLAMP_TO_EDGE)
+            pyglet.gl.glTexParameteri(texture.target, pyglet.gl.GL_TEXTURE_WRAP_T, pyglet.gl.GL_CLAMP_TO_EDGE)
+            self.live_textures += 1
+            self.live_bytes += size[0] * size[1] * 4
+
+        texture.blit_into(image, 0, 0, 0)
+        self.fill_padding(texture, image)
+        self.uploads += 1
+        return texture.get_region(0, 0, image.width, image.height)
+
+    def fill_padding(self, texture, image):
+        # Filtering reads one texel past the region's right and top edges,
+        # into the padding, which holds nothing or an earlier slide. Repeat
+        # the last column and row there, as clamping to the edge would.
+        width, height = image.width, image.height
+        if width < texture.width:
+            texture.blit_into(image.get_region(width - 1, 0, 1, height), width, 0, 0)
+        if height < texture.height:
+            texture.blit_into(image.get_region(0, height - 1, width, 1), 0, height, 0)
+        if width < texture.width and height < texture.height:
+            texture.blit_into(image.get_region(width - 1, height - 1, 1, 1), width, height, 0)
+
+    def release(self, region):
+        texture = region.owner
+        self._idle.setdefault((texture.width, texture.height), []).append(texture)
+        self._idle.move_to_end((texture.width, texture.height))
+        self.trim(self.max_idle)
+
+    def trim(self, max_idle):
+        while sum(len(idle) for idle in self._idle.values()) > max_idle:
+            # Least recently used size first
+            size, idle = next(iter(self._idle.items()))
+            self._delete(idle.pop(0))
+            if not idle:
+                del self._idle[size]
+
+    def clear(self):
+        for idle in self._idle.values():
+            for texture in idle:
+                self._delete(texture)
+        self._idle.clear()
+
+    def _delete(self, texture):
+        pyglet.gl.glDeleteTextures(1, ctypes.byref(pyglet.gl.GLuint(texture.id)))
+        # Already gone, nothing for pyglet's finalizer to delete
+        texture.id = 0
+        self.live_textures -= 1
+        self.live_bytes -= texture.width * texture.height * 4
+
+    def describe(self):
+        idle = sum(len(idle) for idle in self._idle.values())
+        return (f"Textures: {self.live_textures} live, {idle} idle, "
+                f"{self.live_bytes / 1048576:.1f} MB, {self.reused}/{self.uploads} reused")
+
+
+class MemoryBudget:
+    # One account of the pixels the show holds: decoded images in the image
+    # cache, and GPU textures, pooled or kept by animations. The image cache
+    # gets what textures leave of budget, and evicts what's furthest from
+    # the current slide first, least recently used among equals. Having to
+    # evict images about to be shown shrinks decode_scale, so what's decoded
+    # next is smaller, and it grows back once there's room.
+    min_decode_scale = 0.25
+    decode_step = 0.75
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.decode_scale = 1.0
+        self.cache = None
+        self.texture_pool = None
+        self.evictions = 0
+        self.degraded = 0
+        self._ranks = {}
+        self._unpooled = {}
+        self._unpooled_bytes = 0
+
+    def get_texture_bytes(self):
+        pooled = self.texture_pool.live_bytes if self.texture_pool is not None else 0
+        return pooled + self._unpooled_bytes
+
+    def get_image_bytes(self):
+        return self.cache.size if self.cache is not None else 0
+
+    def get_used_bytes(self):
+        return self.get_image_bytes() + self.get_texture_bytes()
+
+    def get_cache_budget(self):
+        return max(0, self.budget - self.get_texture_bytes())
+
+    def set_unpooled(self, owner, image):
+        # image keeps its own textures while owner (a slide) shows it
+        if image is None:
+            self._unpooled.pop(owner, None)
+        else:
+            self._unpooled[owner] = get_image_bytes(image)
+        self._unpooled_bytes = sum(self._unpooled.values())
+
+    def set_wanted(self, filenames, target_size):
+        # Closest to the current slide first
+        ranks = {}
+        for rank, filename in enumerate(filenames):
+            ranks.setdefault((filename, target_size), rank)
+        self._ranks = ranks
+
+    def choose_victim(self, keys, newest):
+        # (key, wanted), anything not wanted at this size goes first
+        ranks = self._ranks
+        victim = None
+        victim_rank = -1
+        for key in keys:
+            if key == newest:
+                continue
+            rank = ranks.get((key[0], key[2]))
+            if rank is None:
+                return key, False
+            if rank > victim_rank:
+                victim, victim_rank = key, rank
+        return victim, True
+
+    def degrade(self):
+        if self.decode_scale > self.min_decode_scale:
+            self.decode_scale = max(self.min_decode_scale, self.decode_scale * self.decode_step)
+            self.degraded += 1
+            print(f"Over the memory budget, decoding at {self.decode_scale:.0%} size", file=sys.stderr)
+
+    def relax(self):
+        # Back up a step when the next size up would fit in half the budget
+        if self.decode_scale < 1 and self.get_used_bytes() < self.budget * self.decode_step ** 2 / 2:
+            self.decode_scale = min(1.0, self.decode_scale / self.decode_step)
+
+    def fits(self, filename):
+        # Whether a full size decode takes at most a quarter of the budget,
+        # from the header, so before decoding it
+        width, height, _, _ = probe_image(filename)
+        return width * height * 4 <= self.budget / 4
+
+    def get_usage(self):
+        return dict(budget=self.budget, used=self.get_used_bytes(),
+                    images=self.get_image_bytes(), image_count=len(self.cache or ()),
+                    textures=self.get_texture_bytes(), decode_scale=self.decode_scale,
+                    evictions=self.evictions, degraded=self.degraded)
+
+    def describe(self):
+        usage = self.get_usage()
+        return (f"Memory: {usage['used'] / 1048576:.0f}/{self.budget / 1048576:.0f} MB, "
+                f"{usage['image_count']} images {usage['images'] / 1048576:.0f} MB, "
+                f"textures {usage['textures'] / 1048576:.0f} MB, "
+                f"decoding at {self.decode_scale:.0%}, {self.evictions} evicted")
+
+
+class TilePyramid:
+    # An image too big for one texture, as levels of JPEG tiles in a disk
+    # cached blob: level 0 is full size and each level after it half the
+    # last, down to a single tile. Tiles are numbered from the bottom left,
+    # the way pyglet's rows run. Blob: header, an (offset, length) entry
+    # per tile, level by level and row by row, then the tiles.
+    header = struct.Struct('<4sHHIIII')
+    entry = struct.Struct('<QI')
+    magic = b'SSTP'
+    version = 1
+    tile_size = 512
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.width, self.height, self.tile_size, count = \
+            self.header.unpack_from(self._blob)
+        if magic != self.magic or version != self.version:
+            raise ValueError(f"{path} isn't a tile pyramid")
+        # (width, height, columns, rows, first tile's entry)
+        self.levels = self.get_levels(self.width, self.height, self.tile_size)
+        if len(self.levels) != count:
+            raise ValueError(f"{path} is damaged")
+
+    @staticmethod
+    def get_levels(width, height, tile_size):
+        levels = []
+        first = 0
+        while True:
+            columns, rows = -(-width // tile_size), -(-height // tile_size)
+            levels.append((width, height, columns, rows, first))
+            first += columns * rows
+            if columns == 1 and rows == 1:
+                return levels
+            # Same rounding as PIL's reduce()
+            width, height = -(-width // 2), -(-height // 2)
+
+    @staticmethod
+    def get_build_bytes(width, height):
+        # The full size RGB level, and the half size one made from it
+        return width * height * 3 * 5 // 4
+
+    def read_tile(self, level, column, row):
+        # (width, height, RGB rows bottom to top), runs on a worker thread
+        _, _, columns, _, first = self.levels[level]
+        offset, length = self.entry.unpack_from(
+            self._blob, self.header.size + self.entry.size * (first + row * columns + column))
+        with PILImage.open(io.BytesIO(self._blob[offset:offset + length])) as tile:
+            tile = tile.convert('RGB')
+        return tile.width, tile.height, tile.transpose(PILImage.FLIP_TOP_BOTTOM).tobytes()
+
+    @classmethod
+    def build(cls, filename, path, max_bytes):
+        # Decodes the whole image once, so it needs that much memory for a
+        # while. Past max_bytes, JPEGs are tiled from a 1/2, 1/4 or 1/8 size
+        # decode and anything else is refused.
+        with open_pil_image(filename, limit=False) as image:
+            width, height = image.size
+            factor = 1
+            while factor < 8 and cls.get_build_bytes(width // factor, height // factor) > max_bytes:
+                factor *= 2
+            if factor > 1:
+                image.draft('RGB', (-(-width // factor), -(-height // factor)))
+            if cls.get_build_bytes(*image.size) > max_bytes:
+                raise PILImage.DecompressionBombError(
+                    f"{width}x{height} is too big to tile in the memory budget")
+            level = image.convert('RGB')
+        levels = cls.get_levels(*level.size, cls.tile_size)
+        _, _, columns, rows, first = levels[-1]
+        entries = bytearray(cls.entry.size * (first + columns * rows))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A private temp file renamed into place, like the disk cache's blobs
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(cls.header.pack(cls.magic, cls.version, 0, level.width, level.height,
+                                           cls.tile_size, len(levels)))
+                file.write(entries)
+                offset = file.tell()
+                for index, (width, height, columns, rows, first) in enumerate(levels):
+                    if index:
+                        level = level.reduce(2)
+                    for row in range(rows):
+                        bottom = height - row * cls.tile_size
+                        top = max(0, bottom - cls.tile_size)
+                        for column in range(columns):
+                            left = column * cls.tile_size
+                            box = (left, top, min(width, left + cls.tile_size), bottom)
+                            tile = io.BytesIO()
+                            level.crop(box).save(tile, 'JPEG', quality=90)
+                            file.write(tile.getbuffer())
+                            cls.entry.pack_into(entries, cls.entry.size * (first + row * columns + column),
+                                                offset, tile.tell())
+                            offset += tile.tell()
+                file.seek(cls.header.size)
+                file.write(entries)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+
+class TiledSlide:
+    # Draws a TilePyramid like a sprite: x, y and scale place the full size
+    # image on screen, and draw() shows the tiles in the window from the
+    # level nearest the size on screen. Missing tiles are read on executor
+    # and uploaded a few a frame, with background (a sprite of the whole
+    # image) drawn underneath until they're in. The least recently drawn
+    # go back to texture_pool once there are more than max_tiles.
+    uploads_per_frame = 4
+
+    def __init__(self, pyramid, window, executor, texture_pool, max_tiles=256, background=None):
+        self.pyramid = pyramid
+        self.background = background
+        self.window = window
+        self.executor = executor
+        self.texture_pool = texture_pool
+        self.max_tiles = max_tiles
+        self.x = 0
+        self.y = 0
+        self.scale = 1.0
+        self.opacity = 255
+        self.visible = True
+        self._tiles = OrderedDict()
+        self._pending = {}
+
+    @property
+    def width(self):
+        return self.pyramid.width * self.scale
+
+    @property
+    def height(self):
+        return self.pyramid.height * self.scale
+
+    def update(self, x=None, y=None, scale=None, opacity=None):
+        if x is not None:
+            self.x = x
+        if y is not None:
+            self.y = y
+        if scale is not None:
+            self.scale = scale
+        if opacity is not None:
+            self.opacity = opacity
+
+    def get_level(self):
+        # The smallest level with at least a pixel for every screen pixel
+        level = 0
+        while level + 1 < len(self.pyramid.levels) and self.scale * 2 ** (level + 1) <= 1:
+            level += 1
+        return level
+
+    def get_visible_tiles(self, level):
+        _, _, columns, rows, _ = self.pyramid.levels[level]
+        size = self.pyramid.tile_size * self.scale * 2 ** level
+        first_column = max(0, int(-self.x // size))
+        last_column = min(columns - 1, int((self.window.width - self.x) // size))
+        first_row = max(0, int(-self.y // size))
+        last_row = min(rows - 1, int((self.window.height - self.y) // size))
+        return [(level, column, row)
+                for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def draw(self):
+        # True while tiles in view are still loading
+        if not self.visible or not self.opacity:
+            return False
+
+        level = self.get_level()
+        visible = self.get_visible_tiles(level)
+        tile_scale = self.scale * 2 ** level
+        size = self.pyramid.tile_size * tile_scale
+        uploads = 0
+        loading = False
+        ready = []
+        for key in visible:
+            sprite = self._tiles.get(key)
+            if sprite is None:
+                future = self._pending.get(key)
+                if future is None:
+                    self._pending[key] = self.executor.submit(self.pyramid.read_tile, *key)
+                    loading = True
+                    continue
+                if not future.done() or uploads == self.uploads_per_frame:
+                    loading = True
+                    continue
+                del self._pending[key]
+                sprite = self._upload(key, *future.result())
+                uploads += 1
+            else:
+                self._tiles.move_to_end(key)
+            ready.append((key, sprite))
+
+        if loading and self.background is not None:
+            self.background.draw()
+        for (_, column, row), sprite in ready:
+            sprite.update(x=self.x + column * size, y=self.y + row * size, scale=tile_scale)
+            if sprite.opacity != self.opacity:
+                sprite.opacity = self.opacity
+            sprite.draw()
+
+        # Panned or zoomed away before they were read
+        visible = set(visible)
+        for key, future in list(self._pending.items()):
+            if key not in visible and future.cancel():
+                del self._pending[key]
+        while len(self._tiles) > max(self.max_tiles, len(visible)):
+            self._release(self._tiles.popitem(last=False)[1])
+        return loading
+
+    def _upload(self, key, width, height, data):
+        image = pyglet.image.ImageData(width, height, 'RGB', data)
+        sprite = pyglet.sprite.Sprite(self.texture_pool.acquire(image))
+        self._tiles[key] = sprite
+        return sprite
+
+    def _release(self, sprite):
+        self.texture_pool.release(sprite.image)
+        sprite.delete()
+
+    def delete(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        for sprite in self._tiles.values():
+            self._release(sprite)
+        self._tiles.clear()
+
+
+class IdleEventLoop(pyglet.app.EventLoop):
+    # With on_demand set, windows are only redrawn after request_redraw,
+    # so a still slide lets the loop sleep until the next event or timer.
+    # wakeups counts loop iterations, to see how often that is.
+    def __init__(self, on_demand=False):
+        super().__init__()
+        self.on_demand = on_demand
+        self.wakeups = 0
+        self.started = None
+        self._redraw_pending = False
+
+    def idle(self):
+        self.wakeups += 1
+        return super().idle()
+
+    def get_wakeup_rate(self):
+        # Wakeups a second since the loop started
+        if self.started is None:
+            return 0.0
+        return self.wakeups / max(time.perf_counter() - self.started, 1e-6)
+
+    def on_enter(self):
+        self.started = time.perf_counter()
+        if self.on_demand:
+            self.clock.unschedule(self._redraw_windows)
+            self.request_redraw()
+
+    def request_redraw(self):
+        if self.on_demand and not self._redraw_pending:
+            self._redraw_pending = True
+            self.clock.schedule_once(self._redraw_requested, 0)
+
+    def _redraw_requested(self, dt):
+        self._redraw_pending = False
+        self._redraw_windows(dt)
+
+
+class FrameExporter:
+    # Renders into an offscreen framebuffer and reads each frame back
+    # through two pixel buffers: frame N is copied into one while frame N-1
+    # is mapped from the other, so the GPU and CPU work at the same time.
+    # Frames go to output, a directory of numbered PNGs or a binary file
+    # of raw top-down RGB, written on background threads.
+    def __init__(self, width, height, output, workers=2):
+        self.width = width
+        self.height = height
+        self.output = output
+        self.frames = 0
+        self._size = width * height * 3
+        self._texture = pyglet.image.Texture.create(width, height)
+        self._framebuffer = pyglet.image.Framebuffer()
+        self._framebuffer.attach_texture(self._texture)
+        self._buffers = (pyglet.gl.GLuint * 2)()
+        pyglet.gl.glGenBuffers(2, self._buffers)
+        for buffer in self._buffers:
+            pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, buffer)
+            pyglet.gl.glBufferData(pyglet.gl.GL_PIXEL_PACK_BUFFER, self._size, None,
+                                   pyglet.gl.GL_STREAM_READ)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+        self._pending = None
+        # A raw stream has to stay in order, so it gets one writer
+        if not isinstance(output, str):
+            workers = 1
+        self._writer = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        self._writes = []
+        self._max_writes = workers * 2
+
+    def begin_frame(self):
+        self._framebuffer.bind()
+
+    def end_frame(self):
+        buffer = self._buffers[self.frames % 2]
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, buffer)
+        pyglet.gl.glPixelStorei(pyglet.gl.GL_PACK_ALIGNMENT, 1)
+        pyglet.gl.glReadPixels(0, 0, self.width, self.height,
+                               pyglet.gl.GL_RGB, pyglet.gl.GL_UNSIGNED_BYTE, None)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+        self._framebuffer.unbind()
+
+        if self._pending is not None:
+            self._collect(*self._pending)
+        self._pending = (buffer, self.frames)
+        self.frames += 1
+
+    def _collect(self, buffer, number):
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, buffer)
+        pointer = pyglet.gl.glMapBufferRange(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0, self._size,
+                                             pyglet.gl.GL_MAP_READ_BIT)
+        data = ctypes.string_at(pointer, self._size)
+        pyglet.gl.glUnmapBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER)
+        pyglet.gl.glBindBuffer(pyglet.gl.GL_PIXEL_PACK_BUFFER, 0)
+
+        # Don't let encoding fall so far behind that frames pile up in memory
+        while len(self._writes) >= self._max_writes:
+            self._writes.pop(0).result()
+        self._writes.append(self._writer.submit(self._write, data, number))
+
+    def _write(self, data, number):
+        if not isinstance(self.output, str):
+            stride = self.width * 3
+            self.output.write(b''.join(data[offset:offset + stride]
+                                       for offset in range(self._size - stride, -1, -stride)))
+            return
+
+        path = os.path.join(self.output, f"frame_{number:06d}.png")
+        if PILImage is not None:
+            # Rows are bottom up, a negative orientation flips them
+            image = PILImage.frombuffer('RGB', (self.width, self.height), data, 'raw', 'RGB', 0, -1)
+            image.save(path, compress_level=1)
+        else:
+            pyglet.image.ImageData(self.width, self.height, 'RGB', data).save(path)
+
+    def finish(self):
+        if self._pending is not None:
+            self._collect(*self._pending)
+            self._pending = None
+        for write in self._writes:
+            write.result()
+        self._writer.shutdown()
+        if not isinstance(self.output, str):
+            self.output.flush()
+        pyglet.gl.glDeleteBuffers(2, self._buffers)
+        self._framebuffer.delete()
+
+
+class Instrumentation:
+    # Where the time goes: per slide load, decode, upload and setup times,
+    # cache hits and misses, and frame time percentiles. Written as JSON
+    # lines to output, when there is one, one line per slide shown.
+    def __init__(self, output=None, frames=600):
+        self.output = output
+        self.slides = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.frames = 0
+        self._frame_intervals = array.array('d', bytes(8 * frames))
+        self._draw_times = array.array('d', bytes(8 * frames))
+        self._last_frame = None
+        self._decode_seconds = OrderedDict()
+        self._slide = None
+        self._last_slide = None
+        # The IdleEventLoop whose wakeups are reported, once it's running
+        self.event_loop = None
+        self._wakeup_mark = None
+        self._lock = threading.Lock()
+
+    def record_decode(self, filename, seconds):
+        # From decode threads, often well before the image is shown
+        with self._lock:
+            self._decode_seconds[filename] = seconds
+            if len(self._decode_seconds) > 256:
+                self._decode_seconds.popitem(last=False)
+
+    def record_disk_cache(self, hit):
+        with self._lock:
+            if hit:
+                self.disk_hits += 1
+            else:
+                self.disk_misses += 1
+
+    def begin_slide(self, filename, load_seconds, cached):
+        self.finish_slide()
+        self.slides += 1
+        if cached:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+        with self._lock:
+            decode_seconds = self._decode_seconds.pop(filename, None)
+        self._slide = dict(event='slide', path=filename, cached=cached,
+                           load_ms=load_seconds * 1000,
+                           decode_ms=decode_seconds and decode_seconds * 1000,
+                           upload_ms=0.0, uploads=0, bytes=0, setup_ms=0.0,
+                           first_frame=self.frames)
+
+    def record_upload(self, seconds, nbytes):
+        if self._slide is not None:
+            self._slide['upload_ms'] += seconds * 1000
+            self._slide['uploads'] += 1
+            self._slide['bytes'] += nbytes
+
+    def record_setup(self, seconds):
+        if self._slide is not None:
+            self._slide['setup_ms'] += seconds * 1000
+
+    def record_frame(self, start, draw_seconds):
+        index = self.frames % len(self._draw_times)
+        self._draw_times[index] = draw_seconds
+        self._frame_intervals[index] = start - (self._last_frame or start)
+        self._last_frame = start
+        self.frames += 1
+
+    def finish_slide(self):
+        if self._slide is None:
+            return
+        slide = self._slide
+        self._slide = None
+        first_frame = slide.pop('first_frame')
+        slide.update(self.get_frame_stats(self.frames - first_frame))
+        self._last_slide = slide
+        self.write(slide)
+
+    def get_frame_stats(self, count=None):
+        count = min(self.frames, len(self._draw_times), count or self.frames)
+        if count == 0:
+            return dict(frames=0)
+        end = self.frames % len(self._draw_times)
+        indexes = [(end - 1 - step) % len(self._draw_times) for step in range(count)]
+        # The first interval after a pause or idle sleep isn't a frame time
+        intervals = sorted(self._frame_intervals[index] for index in indexes[:-1])
+        draws = sorted(self._draw_times[index] for index in indexes)
+        stats = dict(frames=count, draw_p95_ms=get_percentile(draws, 0.95) * 1000)
+        if intervals:
+            stats.update(frame_p50_ms=get_percentile(intervals, 0.5) * 1000,
+                         frame_p95_ms=get_percentile(intervals, 0.95) * 1000,
+                         frame_p99_ms=get_percentile(intervals, 0.99) * 1000)
+        return stats
+
+    def write(self, record):
+        if self.output is None:
+            return
+        record = {name: round(value, 3) if isinstance(value, float) else value
+                  for name, value in record.items()}
+        self.output.write(json.dumps(record) + '\n')
+        self.output.flush()
+
+    def get_recent_wakeup_rate(self):
+        # Wakeups a second since the last call, for the HUD
+        now = time.perf_counter()
+        wakeups = self.event_loop.wakeups
+        if self._wakeup_mark is None:
+            rate = self.event_loop.get_wakeup_rate()
+        else:
+            last, last_wakeups = self._wakeup_mark
+            rate = (wakeups - last_wakeups) / max(now - last, 1e-6)
+        self._wakeup_mark = (now, wakeups)
+        return rate
+
+    def close(self):
+        self.finish_slide()
+        wakeups = {}
+        if self.event_loop is not None:
+            wakeups = dict(wakeups=self.event_loop.wakeups,
+                           wakeups_per_second=self.event_loop.get_wakeup_rate())
+        self.write(dict(event='summary', slides=self.slides,
+                        cache_hits=self.cache_hits, cache_misses=self.cache_misses,
+                        disk_hits=self.disk_hits, disk_misses=self.disk_misses,
+                        **self.get_frame_stats(), **wakeups))
+        if self.output not in (None, sys.stderr, sys.stdout):
+            self.output.close()
+        self.output = None
+
+    def describe(self):
+        slide = self._slide or self._last_slide or {}
+        stats = self.get_frame_stats(120)
+        decode = slide.get('decode_ms')
+        wakeups = ''
+        if self.event_loop is not None:
+            wakeups = f" | wakeups {self.get_recent_wakeup_rate():.0f}/s"
+        return (f"load {slide.get('load_ms', 0):.0f}ms"
+                f" decode {'-' if decode is None else f'{decode:.0f}ms'}"
+                f" upload {slide.get('upload_ms', 0):.1f}ms"
+                f" setup {slide.get('setup_ms', 0):.1f}ms"
+                f" {slide.get('bytes', 0) / 1048576:.1f}MB"
+                f" | cache {self.cache_hits}/{self.slides}"
+                f" | frame p50 {stats.get('frame_p50_ms', 0):.1f}"
+                f" p95 {stats.get('frame_p95_ms', 0):.1f}"
+                f" p99 {stats.get('frame_p99_ms', 0):.1f}ms"
+                f" draw p95 {stats.get('draw_p95_ms', 0):.1f}ms{wakeups}")
+
+
+class MetadataIndex:
+    # Per image columns, row numbers are the playlist's rows
+    keys = ('alpha', 'created', 'modified', 'size', 'taken')
+
+    def __init__(self, playlist, workers=8):
+        self.playlist = playlist
+        self.created = array.array('d')
+        self.modified = array.array('d')
+        self.size = array.array('q')
+        self.width = array.array('I')
+        self.height = array.array('I')
+        self.taken = array.array('d')
+        self.valid = bytearray()
+        self._orders = {}
+        self._workers = workers
+        self._wakeup = threading.Condition()
+        threading.Thread(target=self._build, name='metadata-index', daemon=True).start()
+
+    @property
+    def complete(self):
+        return len(self.taken) == len(self.playlist)
+
+    def update(self):
+        # New rows were appended to paths
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def refresh(self, row):
+        # The file at row was rewritten, rows not read yet will be read anyway
+        if row < len(self.taken):
+            (self.created[row], self.modified[row], self.size[row], self.width[row],
+             self.height[row], self.taken[row], self.valid[row]) = read_image_metadata(self.playlist.path(row))
+            self._orders.clear()
+
+    def is_readable(self, row):
+        # Rows the index hasn't reached yet are probed here and now
+        if row < len(self.taken):
+            return bool(self.valid[row])
+        return probe_image(self.playlist.path(row))[3]
+
+    def get_size(self, row):
+        # (width, height) from the header, None when unknown
+        if row < len(self.taken) and self.width[row]:
+            return self.width[row], self.height[row]
+        return None
+
+    def _build(self):
+        with ThreadPoolExecutor(max_workers=self._workers,
+                                thread_name_prefix='metadata') as pool:
+            while True:
+                with self._wakeup:
+                    while self.complete:
+                        self._wakeup.wait()
+                start = len(self.taken)
+                rows = self.playlist.paths(start, start + 256)
+                for path, (created, modified, size, width, height, taken, valid) in zip(
+                        rows, pool.map(read_image_metadata, rows)):
+                    if not valid:
+                        print(f"Skipping {path}: not a readable image", file=sys.stderr)
+                    self.created.append(created)
+                    self.modified.append(modified)
+                    self.size.append(size)
+                    self.width.append(width)
+                    self.height.append(height)
+                    self.valid.append(valid)
+                    self.taken.append(taken)
+
+    def _sort_key(self, key):
+        if key == 'alpha':
+            path = self.playlist.path
+            return lambda row: path(row).lower()
+
+        column = getattr(self, key)
+        filled = len(column)
+        if key == 'taken':
+            # Photos without EXIF sort by when the file was last written
+            modified = self.modified
+            return lambda row: (0, column[row] or modified[row]) if row < filled else (1, row)
+        return lambda row: (0, column[row]) if row < filled else (1, row)
+
+    def get_order(self, key):
+        count = len(self.playlist)
+        order = self._orders.get(key)
+        if order is not None and len(order) == count:
+            return order
+
+        order = array.array('I', sorted(range(count), key=self._sort_key(key)))
+        # Incomplete columns put unread rows last, don't keep that order
+        if key == 'alpha' or self.complete:
+            self._orders[key] = order
+        return order
+
+
+class Prefetcher:
+    def __init__(self, cache, workers=2):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='prefetch')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _decode(self, key):
+        try:
+            image = timed_decode_image(key[0], key[2])
+            self.cache.put(key, image)
+            return image
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _submit(self, key):
+        # Caller must hold self._lock
+        future = self._pending.get(key)
+        if future is None:
+            future = self._executor.submit(self._decode, key)
+            self._pending[key] = future
+        return future
+
+    def request(self, filename, target_size=None):
+        key = get_image_key(filename, target_size)
+        image = self.cache.get(key)
+        if image is None:
+            with self._lock:
+                return self._submit(key)
+
+        future = Future()
+        future.set_result(image)
+        return future
+
+    def load(self, filename, target_size=None):
+        key = get_image_key(filename, target_size)
+        image = self.cache.get(key)
+        if image is not None:
+            return image
+
+        with self._lock:
+            future = self._pending.get(key)
+            # Queued but not started yet: cheaper to decode right here
+            if future is not None and future.cancel():
+                del self._pending[key]
+                future = None
+        if future is not None:
+            return future.result()
+
+        image = timed_decode_image(filename, key[2])
+        self.cache.put(key, image)
+        return image
+
+    def prefetch(self, filenames, target_size=None):
+        keys = []
+        for filename in filenames:
+            try:
+                keys.append(get_image_key(filename, target_size))
+            except OSError:
+                continue
+
+        with self._lock:
+            # Drop queued work that fell out of the window (sort, random, direction change)
+            for key, future in list(self._pending.items()):
+                if key not in keys and future.cancel():
+                    del self._pending[key]
+
+            for key in keys:
+                if key not in self.cache:
+                    self._submit(key)
+
+    def forget(self, filename):
+        # The file changed or went away, drop anything decoded or queued from it
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key[0] == filename and future.cancel():
+                    del self._pending[key]
+        self.cache.discard(filename)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DirectoryWatcher:
+    # Reports images added to, rewritten in or removed from a directory tree
+    # on a background thread, as (kind, path) tuples on events. kind is
+    # 'added' (new or rewritten), 'removed', or 'removed_directory'.
+    # Subclasses provide _run(), the thread's loop, which watches until the
+    # process exits.
+    def __init__(self, directory, events, recursive=False, max_depth=None,
+                 include=(), exclude=()):
+        self.directory = os.path.abspath(directory)
+        self.events = events
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.include = include
+        self.exclude = exclude
+
+    def start(self):
+        threading.Thread(target=self._run, name='watcher', daemon=True).start()
+        return self
+
+    def _is_excluded(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.exclude)
+
+    def _is_included(self, name):
+        return (not self._is_excluded(name) and
+                (not self.include or any(fnmatch.fnmatch(name, pattern) for pattern in self.include)))
+
+    def _goes_below(self, depth):
+        return self.recursive and (self.max_depth is None or depth < self.max_depth)
+
+    def _add_files_in(self, directory, depth):
+        # A directory moved or copied in, its files never had events of their own
+        remaining = None if self.max_depth is None else self.max_depth - depth
+        for path in scan_directory(directory, self.recursive, remaining, self.include, self.exclude):
+            self.events.put(('added', path))
+
+
+class InotifyWatcher(DirectoryWatcher):
+    # Linux inotify through libc, one watch per directory
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0x80000
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    event = struct.Struct('iIII')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._watches = {}
+        self._watch_ids = {}
+        # Watch before the first scan finishes, so nothing added meanwhile is missed
+        self._watch_tree(self.directory, 0)
+
+    def _watch_tree(self, directory, depth):
+        pending = [(directory, depth)]
+        while pending:
+            directory, depth = pending.pop()
+            watch = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.mask)
+            if watch < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    # Out of watches (fs.inotify.max_user_watches), fall back to polling
+                    raise OSError(error, os.strerror(error))
+                print(f"Can't watch {directory}: {os.strerror(error)}", file=sys.stderr)
+                continue
+            self._watches[watch] = (directory, depth)
+            self._watch_ids[directory] = watch
+            if not self._goes_below(depth):
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not self._is_excluded(entry.name) and entry.is_dir(follow_symlinks=False):
+                            pending.append((entry.path, depth + 1))
+            except OSError:
+                pass
+
+    def _unwatch_tree(self, directory):
+        prefix = os.path.join(directory, '')
+        for path in [path for path in self._watch_ids if path == directory or path.startswith(prefix)]:
+            watch = self._watch_ids.pop(path)
+            self._watches.pop(watch, None)
+            self._libc.inotify_rm_watch(self._fd, watch)
+
+    def _run(self):
+        while True:
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                watch, mask, _, length = self.event.unpack_from(data, offset)
+                offset += self.event.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._handle(watch, mask, name)
+
+    def _handle(self, watch, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            print("Too many file changes at once, some were missed", file=sys.stderr)
+            return
+        if mask & self.IN_IGNORED:
+            # Watched directory was deleted or unmounted
+            directory, _ = self._watches.pop(watch, (None, 0))
+            if self._watch_ids.get(directory) == watch:
+                del self._watch_ids[directory]
+            return
+        if watch not in self._watches:
+            return
+
+        directory, depth = self._watches[watch]
+        path = os.path.join(directory, name)
+        if mask & self.IN_ISDIR:
+            if self._is_excluded(name) or not self._goes_below(depth):
+                return
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._watch_tree(path, depth + 1)
+                self._add_files_in(path, depth + 1)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self._unwatch_tree(path)
+                self.events.put(('removed_directory', path))
+        elif self._is_included(name):
+            # Files are only added once they're closed after writing, or moved
+            # in whole, so a half written download doesn't get shown
+            if mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                self.events.put(('added', path))
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self.events.put(('removed', path))
+
+
+class PollingWatcher(DirectoryWatcher):
+    # Where there's no inotify. Directory mtimes change when entries are
+    # added, removed or renamed, so only directories that changed get listed
+    # again, and names are compared by inode to catch a file replaced by a
+    # rename. Rewriting a file in place isn't seen, cached decodes are keyed
+    # by the file's mtime so they're never shown stale regardless.
+    def __init__(self, *args, interval=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self._listings = {}
+
+    def _run(self):
+        self._list_tree(self.directory, 0)
+        while True:
+            time.sleep(self.interval)
+            for directory, (mtime, depth, _, _) in list(self._listings.items()):
+                if directory not in self._listings:
+                    # Went with a parent listed earlier in this pass
+                    continue
+                try:
+                    changed = os.stat(directory).st_mtime_ns != mtime
+                except OSError:
+                    # Gone, its parent's listing reports it
+                    continue
+                if changed:
+                    self._update(directory, depth)
+
+    def _list(self, directory):
+        mtime = os.stat(directory).st_mtime_ns
+        files = {}
+        subdirs = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self._is_excluded(entry.name):
+                            subdirs.add(entry.name)
+                    elif self._is_included(entry.name):
+                        files[entry.name] = entry.inode()
+                except OSError:
+                    continue
+        return mtime, files, subdirs
+
+    def _list_tree(self, directory, depth):
+        pending = [(directory, depth)]
+        while pending:
+            directory, depth = pending.pop()
+            try:
+                mtime, files, subdirs = self._list(directory)
+            except OSError:
+                continue
+            self._listings[directory] = (mtime, depth, files, subdirs)
+            if self._goes_below(depth):
+                pending.extend((os.path.join(directory, name), depth + 1) for name in subdirs)
+
+    def _update(self, directory, depth):
+        _, _, files, subdirs = self._listings[directory]
+        try:
+            mtime, new_files, new_subdirs = self._list(directory)
+        except OSError:
+            return
+        self._listings[directory] = (mtime, depth, new_files, new_subdirs)
+
+        for name in files.keys() - new_files.keys():
+            self.events.put(('removed', os.path.join(directory, name)))
+        for name, inode in new_files.items():
+            if files.get(name) != inode:
+                self.events.put(('added', os.path.join(directory, name)))
+        if not self._goes_below(depth):
+            return
+        for name in subdirs - new_subdirs:
+            path = os.path.join(directory, name)
+            prefix = os.path.join(path, '')
+            for listed in [listed for listed in self._listings if listed == path or listed.startswith(prefix)]:
+                del self._listings[listed]
+            self.events.put(('removed_directory', path))
+        for name in new_subdirs - subdirs:
+            path = os.path.join(directory, name)
+            self._list_tree(path, depth + 1)
+            self._add_files_in(path, depth + 1)
+
+
+class Session:
+    # Where a show was, to pick up from on the next run. The playlist is an
+    # append only log of chunks, each checked by a crc32 so one cut short is
+    # dropped when it's read back; the play order (sorted, or a shuffle's
+    # segments and merges) and a small state record are files of their own,
+    # replaced whole by renaming a temporary file over them. Each save
+    # writes only what changed since the last one.
+    def __init__(self, path):
+        self.path = path
+        self._rows = 0
+        self._directories = 0
+        self._size = 0 # valid bytes in the playlist log, none until written
+        self._order = None
+        self._order_count = 0
+        self._state = None
+
+    def load(self):
+        # (playlist, row, interval, ken_burns, random_image), None without
+        # a usable snapshot
+        playlist = self._read_playlist()
+        if playlist is None:
+            return None
+        try:
+            with open(self.path + '.state', 'rb') as file:
+                data = file.read()
+            magic, version, flags, interval, row, seed_size = SESSION_STATE.unpack_from(data)
+            seed = int(data[SESSION_STATE.size:SESSION_STATE.size + seed_size]) if seed_size else None
+        except (OSError, ValueError, struct.error):
+            return None
+        if magic != SESSION_STATE_MAGIC or version != SESSION_VERSION or interval <= 0:
+            return None
+
+        order = self._read_order() if flags & (SESSION_SHUFFLED | SESSION_SORTED) else None
+        if flags & SESSION_SHUFFLED and seed is not None:
+            shuffle = RandomOrder.from_state(len(playlist), seed, order)
+            if shuffle is not None:
+                playlist.set_order(shuffle)
+                self._order, self._order_count = order, len(order)
+            else:
+                playlist.shuffle(seed)
+        elif (flags & SESSION_SORTED and order is not None and len(order) == len(playlist)
+                and max(order) < len(playlist)):
+            playlist.set_order(order)
+            self._order, self._order_count = playlist.order, len(order)
+        self._state = data
+        row = row if row < len(playlist) else 0
+        return playlist, row, interval, bool(flags & SESSION_KEN_BURNS), bool(flags & SESSION_RANDOM)
+
+    def save(self, playlist, row, interval, ken_burns, random_image):
+        # Playlist first, an order or state never refers to rows not written yet
+        self._save_playlist(playlist)
+        order = playlist.order
+        flags = (SESSION_KEN_BURNS if ken_burns else 0) | (SESSION_RANDOM if random_image else 0)
+        seed = b''
+        if isinstance(order, RandomOrder):
+            flags |= SESSION_SHUFFLED
+            seed = str(order.seed).encode()
+            self._save_order(order)
+        elif order is not None:
+            flags |= SESSION_SORTED
+            self._save_order(order)
+
+        state = SESSION_STATE.pack(SESSION_STATE_MAGIC, SESSION_VERSION, flags, interval,
+                                   row, len(seed)) + seed
+        if state != self._state and self._replace(self.path + '.state', state):
+            self._state = state
+
+    def _read_playlist(self):
+        try:
+            with open(self.path + '.playlist', 'rb') as file:
+                data = file.read()
+            magic, version = SESSION_PLAYLIST_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if magic != SESSION_PLAYLIST_MAGIC or version != SESSION_VERSION:
+            return None
+
+        playlist = Playlist()
+        offset = SESSION_PLAYLIST_HEADER.size
+        names_end = 0
+        while offset + SESSION_CHUNK.size <= len(data):
+            rows, directories_size, names_size, crc = SESSION_CHUNK.unpack_from(data, offset)
+            start = offset + SESSION_CHUNK.size
+            end = start + directories_size + rows * 12 + names_size
+            payload = data[start:end]
+            if end > len(data) or zlib.crc32(payload) != crc:
+                # Cut short while it was written, later chunks can't follow on
+                break
+            directories = [os.fsdecode(directory)
+                           for directory in payload[:directories_size].split(b'\0')[:-1]]
+            directory_of = array.array('I', payload[directories_size:directories_size + rows * 4])
+            name_ends = array.array('Q', payload[directories_size + rows * 4:directories_size + rows * 12])
+            names = payload[directories_size + rows * 12:]
+            directory_count = len(playlist.directories) + len(directories)
+            names_end += len(names)
+            if rows and (max(directory_of) >= directory_count or name_ends[-1] != names_end):
+                break
+            playlist.extend_chunk(directories, directory_of, name_ends, names)
+            offset = end
+
+        if not len(playlist):
+            return None
+        self._rows = len(playlist)
+        self._directories = len(playlist.directories)
+        self._size = offset
+        return playlist
+
+    def _save_playlist(self, playlist):
+        rows = len(playlist)
+        if self._size and rows == self._rows:
+            return
+        directories, directory_of, name_ends, names = playlist.get_chunk(self._rows, self._directories)
+        directories = b''.join(os.fsencode(directory) + b'\0' for directory in directories)
+        payload = directories + directory_of.tobytes() + name_ends.tobytes() + names
+        chunk = SESSION_CHUNK.pack(rows - self._rows, len(directories), len(names),
+                                   zlib.crc32(payload)) + payload
+
+        if not self._size:
+            # A new session replaces whatever an earlier one left
+            data = SESSION_PLAYLIST_HEADER.pack(SESSION_PLAYLIST_MAGIC, SESSION_VERSION) + chunk
+            if not self._replace(self.path + '.playlist', data):
+                return
+            self._size = len(data)
+        else:
+            try:
+                with open(self.path + '.playlist', 'r+b') as file:
+                    # Over anything a previous append left half written
+                    file.seek(self._size)
+                    file.write(chunk)
+                    file.truncate()
+            except OSError:
+                return
+            self._size += len(chunk)
+        self._rows = rows
+        self._directories = len(playlist.directories)
+
+    def _read_order(self):
+        # A sorted order, or a shuffle's RandomOrder.get_state()
+        try:
+            with open(self.path + '.order', 'rb') as file:
+                data = file.read()
+            magic, version, order_count = SESSION_ORDER_HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if (magic != SESSION_ORDER_MAGIC or version != SESSION_VERSION or not order_count
+                or len(data) != SESSION_ORDER_HEADER.size + order_count * 4):
+            return None
+        return array.array('I', data[SESSION_ORDER_HEADER.size:])
+
+    def _save_order(self, order):
+        # Sorting makes a new order, and new rows grow it; a shuffle's
+        # segments and merges are few enough to compare
+        if isinstance(order, RandomOrder):
+            order = saved = order.get_state()
+            if order == self._order:
+                return
+        elif order is self._order and len(order) == self._order_count:
+            return
+        else:
+            saved = order
+        data = SESSION_ORDER_HEADER.pack(SESSION_ORDER_MAGIC, SESSION_VERSION, len(order)) + order.tobytes()
+        if self._replace(self.path + '.order', data):
+            self._order, self._order_count = saved, len(saved)
+
+    def _replace(self, path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+            return True
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return False
+
+
+class PlaylistReconciler:
+    # Matches the source, listed again, against a playlist read back from a
+    # session: paths already in it are ticked off, new ones are passed on,
+    # and the rows never listed are the ones that have gone
+    def __init__(self, playlist):
+        self.playlist = playlist
+        self.seen = bytearray(len(playlist))
+        self._names = {}
+
+    def match(self, paths):
+        # The paths that aren't in the playlist yet
+        added = []
+        for path in paths:
+            directory, name = os.path.split(path)
+            names = self._names.get(directory)
+            if names is None:
+                names = self._names[directory] = self.playlist.get_directory_names(directory)
+            rows = names.get(name)
+            if rows is None:
+                # Listed once, even if the source lists it again
+                names[name] = ()
+                added.append(path)
+            for row in rows or ():
+                self.seen[row] = 1
+        return added
+
+    def get_missing(self):
+        return [row for row, seen in enumerate(self.seen) if not seen]
+
+
+archives = {}
+decode_pool = None
+decode_at_display_size = True
+disk_cache = None
+disk_cache_size = 4096 * 1024 * 1024
 drag_pan = False # on during pan and off at the next mouse
+event_loop = None
+export_fps = 30
+export_time = None
 image_filename = ""
 image_index = 0
-image_paths = []
+image_paths = Playlist()
+instrumentation = Instrumentation()
 img = None
 ken_burns = True
+memory = MemoryBudget(1024 * 1024 * 1024)
+metadata = None
 mouse_hide_delay = 1
+oversize_scale = 1.2
 osd_banner_delay = 5
 pan_speed_alt_axis = 3
 pan_speed_fastest = 40
 pan_speed_slowest = 20
 pan_speed_x = 10
 pan_speed_y = 10
+frame_interval = 1/60.0
+outgoing_motion = None
+outgoing_slide = None
+outgoing_texture = None
 paused = False
+pending_slide = None # (row, filename, future, start, cached, direction)
+performance_hud = False
+pil_open_lock = threading.Lock()
+# Pillow's decompression bomb limit, lifted only by open_pil_image(limit=False)
+pil_pixel_limit = PILImage.MAX_IMAGE_PIXELS if PILImage is not None else None
+playing_animation = None
+prefetch_ahead = 3
+prefetch_behind = 1
+prefetch_workers = 2
+prefetcher = None
 progress = 0
 progress_bar_height = 2
+refined_image = None
 random_image = False
-saved_image_paths = []
+random_seed = None
+reconciler = None
+session = None
+session_save_seconds = 2.0
 slide = None
+slide_frame = None
+slide_frame_rect = None
+slide_motion = None
+slide_texture = None
+source_batches = queue.Queue()
+source_loading = False
+source_batch_size = 512
+source_batch_seconds = 0.1
 status_label = None
 status_label_hide_delay = 1
 status_label_small = None
+texture_pool = None
+tile_builder = None
+tile_builds = {}
+tile_executor = None
+tile_threshold = 8192 # pixels on the longest side
+tiled_slides = {}
+untileable = set()
+transition = 'crossfade'
+transition_seconds = 0.6
+transition_start = None
+travel_direction = 1
 update_interval_seconds = 6.0
+watch_events = queue.Queue()
+watch_poll_seconds = 2.0
+watcher = None
 window = pyglet.window.Window(resizable=True, style="borderless")
+
+# Everything drawn over the slide, created once and updated as it changes
+overlay_batch = pyglet.graphics.Batch()
+frame_group = pyglet.graphics.Group(order=0)
+progress_background_group = pyglet.graphics.Group(order=1)
+progress_group = pyglet.graphics.Group(order=2)
+label_group = pyglet.graphics.Group(order=3)
 zoom_speed = 0.0014
 
 
@@ -192,6 +2399,7 @@ def osd_banner(message, delay=osd_banner_delay):
     banner_label.x = window.width // 2
     banner_label.y = window.height // 2
     banner_label.show(message)
+    request_redraw()
 
     pyglet.clock.schedule_once(hide_osd_banner, delay)
 
@@ -199,6 +2407,7 @@ def osd_banner(message, delay=osd_banner_delay):
 def osd(message, delay=status_label_hide_delay):
     pyglet.clock.unschedule(hide_status_message)
     status_label.show(message)
+    request_redraw()
     pyglet.clock.schedule_once(hide_status_message, delay)
 
 
@@ -206,32 +2415,122 @@ def osd_small(message, delay=status_label_hide_delay):
     pyglet.clock.unschedule(hide_small_status_message)
     status_label_small.x = window.width - 10
     status_label_small.show(message)
+    request_redraw()
     pyglet.clock.schedule_once(hide_small_status_message, delay)
 
 
+def open_pil_image(filename, limit=True):
+    # PIL's Image.open, without its decompression bomb limit when limit is
+    # False, for callers that check the size they decode themselves. The
+    # limit is a Pillow global, so opens take turns to set it.
+    file = open_archive_member(filename) or filename
+    with pil_open_lock:
+        PILImage.MAX_IMAGE_PIXELS = pil_pixel_limit if limit else None
+        try:
+            return PILImage.open(file)
+        finally:
+            PILImage.MAX_IMAGE_PIXELS = pil_pixel_limit
+
+
 def is_gif_animation(image):
     return isinstance(image, pyglet.image.Animation)
 
 
+def is_animated_file(filename):
+    if PILImage is None or not filename.endswith(ANIMATION_EXTENSIONS):
+        return False
+    with open_pil_image(filename) as image:
+        return getattr(image, 'is_animated', False)
+
+
+def decode_animation_frames(filename, frames, owner):
+    # Queues (frame, duration) tuples, or (None, error) and stops when a
+    # frame won't decode
+    try:
+        with open_pil_image(filename) as image:
+            width, height = image.size
+            index = 0
+            while owner() is not None:
+                try:
+                    image.seek(index)
+                except EOFError:
+                    index = 0
+                    continue
+                index += 1
+
+                data = image.convert('RGBA').transpose(PILImage.FLIP_TOP_BOTTOM).tobytes()
+                frame = pyglet.image.ImageData(width, height, 'RGBA', data, width * 4)
+                # Like browsers, treat very short delays as unset
+                duration = image.info.get('duration') or 100
+                duration = duration / 1000 if duration > 10 else 0.1
+                put_animation_frame(frames, (frame, duration), owner)
+    except DECODE_ERRORS as e:
+        put_animation_frame(frames, (None, e), owner)
+
+
+def put_animation_frame(frames, frame, owner):
+    while owner() is not None:
+        try:
+            frames.put(frame, timeout=0.5)
+            return
+        except queue.Full:
+            pass
+
+
+def show_image(image):
+    global playing_animation
+    if playing_animation is not None:
+        playing_animation.stop()
+        playing_animation = None
+
+    if isinstance(image, AnimationStream):
+        playing_animation = image
+        image.play(set_slide_texture)
+    else:
+        set_slide_texture(image)
+
+
+def set_slide_texture(image):
+    global slide_texture
+    previous = slide_texture
+    if texture_pool is not None and type(image) is pyglet.image.ImageData:
+        start = time.perf_counter()
+        slide_texture = texture_pool.acquire(image)
+        instrumentation.record_upload(time.perf_counter() - start, get_image_bytes(image))
+        slide.image = slide_texture
+        memory.set_unpooled(slide, None)
+    else:
+        # Animations and compressed images keep their own textures
+        slide_texture = None
+        slide.image = image
+        memory.set_unpooled(slide, image)
+
+    if previous is not None:
+        texture_pool.release(previous)
+    request_redraw()
+
+
 def hide_small_status_message(dt):
     status_label_small.hide()
+    request_redraw()
 
 
 def hide_status_message(dt):
     status_label.hide()
+    request_redraw()
 
 
 def hide_osd_banner(dt):
     banner_label.hide()
+    request_redraw()
 
 
 def coin_toss():
     return random.randint(0,100) > 50
 
 
-def randomize_pan_zoom_speeds(image):
+def randomize_pan_zoom_speeds(width, height):
     global pan_speed_x, pan_speed_y, zoom_speed
-    width, height = get_width_height(image)
     if is_landscape(width, height):
         pan_speed_x = random.randint(pan_speed_slowest, pan_speed_fastest) * (height/width)
         pan_speed_y = random.randint(-pan_speed_alt_axis, pan_speed_alt_axis) * (height/width)
@@ -246,22 +2545,499 @@ def randomize_pan_zoom_speeds(image):
     zoom_speed = random.uniform(-0.003,-0.001)
 
 
-def update_pan(dt):
-    if ken_burns:
-        slide.x += dt * pan_speed_x
-        slide.y += dt * pan_speed_y
+def get_frame_interval():
+    try:
+        mode = window.screen.get_mode()
+    except NotImplementedError:
+        mode = None
+    rate = getattr(mode, 'rate', 0)
+    return 1 / rate if rate else 1/60.0
 
 
-def update_zoom(dt):
-    if ken_burns:
-        slide.scale -= dt * zoom_speed
+def get_animation_time():
+    # Exports run on a virtual clock, a frame at a time
+    if export_time is not None:
+        return export_time
+    return time.perf_counter()
+
+
+def get_motion():
+    return (get_animation_time(), slide.x, slide.y, slide.scale,
+            pan_speed_x, pan_speed_y, zoom_speed)
+
+
+def get_motion_pose(motion, now):
+    start, x, y, scale, speed_x, speed_y, speed_zoom = motion
+    elapsed = now - start if ken_burns else 0
+    return x + elapsed * speed_x, y + elapsed * speed_y, scale - elapsed * speed_zoom
+
+
+def rebase_motion():
+    # Ken Burns is a closed form of the time since the slide was last placed,
+    # so anything that moves the slide by hand starts a new motion from there
+    global slide_motion
+    slide_motion = get_motion()
+    if is_animating():
+        start_animation()
+    else:
+        stop_animation()
+    request_redraw()
+
+
+def rescale_motion(ratio):
+    global slide_motion
+    start, x, y, scale, speed_x, speed_y, speed_zoom = slide_motion
+    slide_motion = (start, x, y, scale * ratio, speed_x, speed_y, speed_zoom * ratio)
+
+
+def start_animation():
+    pyglet.clock.unschedule(animate_slides)
+    pyglet.clock.schedule_interval(animate_slides, frame_interval)
+
+
+def stop_animation():
+    pyglet.clock.unschedule(animate_slides)
+
+
+def is_animating():
+    # pyglet plays Animations on the sprite by itself, they just need redraws
+    return ken_burns or transition_start is not None or is_gif_animation(slide.image)
+
+
+def request_redraw():
+    if event_loop is not None:
+        event_loop.request_redraw()
+
 
+def animate_slides(dt):
+    request_redraw()
+    now = get_animation_time()
+    x, y, scale = get_motion_pose(slide_motion, now)
+    if transition_start is None:
+        slide.update(x=x, y=y, scale=scale)
+        if not is_animating():
+            stop_animation()
+        return
 
-def load_image(filename):
-    if filename.endswith('gif'):
-        return pyglet.image.load_animation(filename)
+    progress = min(1.0, (now - transition_start) / transition_seconds)
+    eased = progress * progress * (3 - 2 * progress)
+    # The outgoing slide keeps its own motion while it leaves
+    out_x, out_y, out_scale = get_motion_pose(outgoing_motion, now)
+    if transition == 'slide':
+        offset = window.width * (1 - eased) * travel_direction
+        x += offset
+        out_x += offset
     else:
-        return pyglet.image.load(filename)
+        slide.opacity = round(255 * eased)
+
+    if transition == 'zoom':
+        factor = 0.85 + 0.15 * eased
+        width, height = get_width_height(slide.image)
+        x += width * scale * (1 - factor) / 2
+        y += height * scale * (1 - factor) / 2
+        scale *= factor
+
+    slide.update(x=x, y=y, scale=scale)
+    outgoing_slide.update(x=out_x, y=out_y, scale=out_scale)
+    if progress >= 1:
+        end_transition()
+
+
+def change_slide(image):
+    global slide, outgoing_slide, slide_texture, outgoing_texture, outgoing_motion
+    if transition == 'none':
+        detach_tiles(slide)
+        show_image(image)
+        attach_tiles(slide, image_filename, image)
+        setup_slide()
+        return
+
+    # Double buffered: the current sprite becomes the outgoing one, and the
+    # idle sprite gets the new image
+    end_transition()
+    slide, outgoing_slide = outgoing_slide, slide
+    slide_texture, outgoing_texture = None, slide_texture
+    outgoing_motion = slide_motion
+
+    show_image(image)
+    attach_tiles(slide, image_filename, image)
+    setup_slide()
+    start_transition()
+
+
+def start_transition():
+    global transition_start
+    slide.visible = True
+    # Timed from here, once the new texture is uploaded, so decode time
+    # never eats into the transition
+    transition_start = get_animation_time()
+    animate_slides(0)
+    start_animation()
+
+
+def end_transition():
+    global transition_start, outgoing_texture
+    if transition_start is None:
+        return
+
+    transition_start = None
+    slide.opacity = 255
+    outgoing_slide.visible = False
+    detach_tiles(outgoing_slide)
+    if outgoing_texture is not None:
+        texture_pool.release(outgoing_texture)
+        outgoing_texture = None
+    animate_slides(0)
+
+
+def decode_image(filename, target_size=None):
+    if is_animated_file(filename):
+        return AnimationStream(filename)
+
+    if filename.endswith('gif') and PILImage is None:
+        return pyglet.image.load_animation(filename, file=open_archive_member(filename))
+
+    if disk_cache is None or target_size is None:
+        return decode_still_image(filename, target_size)
+
+    image = disk_cache.get(filename, target_size)
+    instrumentation.record_disk_cache(image is not None)
+    if image is None:
+        image = decode_still_image(filename, target_size)
+        disk_cache.put(filename, target_size, image)
+    return image
+
+
+def timed_decode_image(filename, target_size=None):
+    start = time.perf_counter()
+    image = decode_image(filename, target_size)
+    instrumentation.record_decode(filename, time.perf_counter() - start)
+    return image
+
+
+def decode_still_image(filename, target_size=None):
+    if decode_pool is not None:
+        try:
+            shared = decode_pool.submit(decode_to_shared_memory, filename, target_size).result()
+            return attach_shared_image(*shared)
+        except BrokenProcessPool:
+            pass
+
+    pixels = read_reduced_pixels(filename, target_size)
+    if pixels is not None:
+        return make_image_data(*pixels)
+
+    return pyglet.image.load(filename, file=open_archive_member(filename))
+
+
+def read_pixels(filename):
+    image = pyglet.image.load(filename, file=open_archive_member(filename)).get_image_data()
+    # Keep the codec's own layout, converting here would be a slow per-pixel pass
+    fmt = image.format
+    pitch = image.pitch
+    data = image.get_data(fmt, pitch)
+    return image.width, image.height, fmt, pitch, data, image.width, image.height
+
+
+def read_reduced_pixels(filename, target_size):
+    # Formats pyglet can't decode come through here at full size too
+    pil_only = filename.endswith(PIL_ONLY_EXTENSIONS)
+    if PILImage is None or (target_size is None and not pil_only):
+        return None
+
+    # Over Pillow's limit is fine as long as draft() brings it under
+    with open_pil_image(filename, limit=False) as image:
+        full_width, full_height = image.size
+        scale = 1
+        if target_size is not None:
+            scale = min(1, get_fit_scale_for_size(target_size[0], target_size[1],
+                                                  full_width, full_height),
+                        # Bigger images are drawn from tiles, this is the overview
+                        tile_threshold / max(full_width, full_height))
+        if scale == 1 and not pil_only:
+            return None
+
+        size = (max(1, round(full_width * scale)), max(1, round(full_height * scale)))
+        # JPEG decodes straight to 1/2, 1/4 or 1/8 size in the DCT
+        image.draft('RGB', size)
+        if image.width * image.height > 2 * pil_pixel_limit:
+            raise PILImage.DecompressionBombError(
+                f"{full_width}x{full_height} is too big to decode")
+        fmt = 'RGBA' if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info else 'RGB'
+        image = image.convert(fmt)
+        if image.size != size:
+            image = image.resize(size, PILImage.BILINEAR, reducing_gap=2.0)
+        # pyglet rows run bottom to top
+        data = image.transpose(PILImage.FLIP_TOP_BOTTOM).tobytes()
+
+    width, height = size
+    return width, height, fmt, width * len(fmt), data, full_width, full_height
+
+
+def make_image_data(width, height, fmt, pitch, data, full_width, full_height):
+    image = pyglet.image.ImageData(width, height, fmt, data, pitch)
+    image.full_width = full_width
+    image.full_height = full_height
+    return image
+
+
+def decode_to_shared_memory(filename, target_size=None):
+    # Runs in a decode_pool worker process
+    pixels = read_reduced_pixels(filename, target_size) or read_pixels(filename)
+    width, height, fmt, pitch, data, full_width, full_height = pixels
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    shm.buf[:len(data)] = data
+    shm.close()
+    return shm.name, width, height, fmt, pitch, len(data), full_width, full_height
+
+
+def attach_shared_image(name, width, height, fmt, pitch, size, full_width, full_height):
+    shm = shared_memory.SharedMemory(name=name)
+    # The mapping stays valid after unlink, until the image is released
+    shm.unlink()
+    pixels = (ctypes.c_ubyte * size).from_buffer(shm.buf)
+    image = make_image_data(width, height, fmt, pitch, pixels, full_width, full_height)
+    image.shared_memory = shm
+    return image
+
+
+def start_decode_pool(workers):
+    # Spawned workers would re-import this script and open a window,
+    # so the process decoder is only available where fork is.
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print("Process decoder needs fork, using threads", file=sys.stderr)
+        return None
+
+    # Workers must share our resource tracker, not fork their own
+    resource_tracker.ensure_running()
+
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context('fork'))
+        # Fork every worker now, from the main thread, before playback starts
+        pool.submit(os.getpid).result()
+    except OSError as e:
+        print(f"Process decoder unavailable ({e}), using threads", file=sys.stderr)
+        return None
+
+    return pool
+
+
+def load_image(filename, target_size=None):
+    start = time.perf_counter()
+    cached = False
+    if prefetcher is None:
+        image = timed_decode_image(filename, target_size)
+    else:
+        cached = get_image_key(filename, target_size) in prefetcher.cache
+        image = prefetcher.load(filename, target_size)
+    instrumentation.begin_slide(filename, time.perf_counter() - start, cached)
+    return image
+
+
+def get_image_key(filename, target_size=None):
+    if target_size is None and not memory.fits(filename):
+        # Too big for the memory budget at full size
+        target_size = get_display_target_size()
+    return (filename, stat_image(filename).st_mtime_ns, target_size)
+
+
+def get_decode_target_size():
+    if not decode_at_display_size and memory.decode_scale == 1:
+        return None
+    return get_display_target_size()
+
+
+def get_display_target_size():
+    # Sized for a fullscreen Ken Burns slide on this screen (or the window,
+    # if it's bigger), so it doesn't change, and miss the disk cache, on resize
+    screen = window.screen
+    width = max(window.width, screen.width)
+    height = max(window.height, screen.height)
+    scale = oversize_scale * memory.decode_scale
+    return (round(width * scale), round(height * scale))
+
+
+def get_slide_size():
+    # Known from the header before the decode finishes, same aspect either way
+    size = None
+    if metadata is not None and image_filename == image_paths[image_index]:
+        size = metadata.get_size(image_paths.row(image_index))
+    return size or get_width_height(img)
+
+
+def get_full_width_height(image):
+    width, height = get_width_height(image)
+    return (getattr(image, 'full_width', width), getattr(image, 'full_height', height))
+
+
+def refine_slide_resolution():
+    global refined_image
+    if prefetcher is None or refined_image is not None or slide.scale <= 1:
+        return
+
+    width, height = get_width_height(img)
+    full_width, full_height = get_full_width_height(img)
+    if width >= full_width or is_tiled_size(full_width, full_height):
+        # Tiles do it for big images
+        return
+
+    # Zoomed past the decoded pixels, fetch twice what's needed now
+    target_size = (round(width * slide.scale * 2), round(height * slide.scale * 2))
+    refined_image = (image_filename, prefetcher.request(image_filename, target_size))
+    pyglet.clock.schedule_interval(apply_refined_image, 0.05)
+
+
+def get_max_texture_size():
+    size = pyglet.gl.GLint()
+    pyglet.gl.glGetIntegerv(pyglet.gl.GL_MAX_TEXTURE_SIZE, size)
+    return size.value
+
+
+def is_tiled_size(width, height):
+    return max(width, height) > min(tile_threshold, get_max_texture_size())
+
+
+def get_tile_pyramid_path(filename):
+    stat = stat_image(filename)
+    key = f"{filename}\0{stat.st_size}\0{stat.st_mtime_ns}\0tiles"
+    digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+    directory = disk_cache.directory if disk_cache is not None else get_default_cache_dir()
+    return os.path.join(directory, digest[:2], digest + '.tiles')
+
+
+def attach_tiles(sprite, filename, image):
+    # Big images are drawn from tiles once their pyramid's built, until
+    # then the sprite shows the decoded image on its own
+    global tile_executor
+    if PILImage is None or filename in untileable or not is_tiled_size(*get_full_width_height(image)):
+        return
+    try:
+        path = get_tile_pyramid_path(filename)
+    except OSError as e:
+        print(f"Can't tile {filename}: {e}", file=sys.stderr)
+        untileable.add(filename)
+        return
+    try:
+        pyramid = TilePyramid(path)
+    except FileNotFoundError:
+        start_tile_build(filename, path)
+        return
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Can't read tiles for {filename}: {e}", file=sys.stderr)
+        untileable.add(filename)
+        return
+
+    if tile_executor is None:
+        tile_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tiles')
+    # A quarter of the memory budget in 512px tiles
+    max_tiles = max(64, memory.budget // 4 // (TilePyramid.tile_size ** 2 * 4))
+    tiled_slides[sprite] = TiledSlide(pyramid, window, tile_executor, texture_pool, max_tiles, sprite)
+    request_redraw()
+
+
+def detach_tiles(sprite):
+    tiles = tiled_slides.pop(sprite, None)
+    if tiles is not None:
+        tiles.delete()
+
+
+def start_tile_build(filename, path):
+    global tile_builder
+    if filename in tile_builds:
+        return
+    if tile_builder is None:
+        tile_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile-build')
+    tile_builds[filename] = tile_builder.submit(TilePyramid.build, filename, path, memory.budget)
+    pyglet.clock.schedule_interval(check_tile_builds, 0.5)
+
+
+def check_tile_builds(dt):
+    for filename, future in list(tile_builds.items()):
+        if not future.done():
+            continue
+        del tile_builds[filename]
+        if future.exception() is not None:
+            print(f"Can't tile {filename}: {future.exception()}", file=sys.stderr)
+            untileable.add(filename)
+        elif filename == image_filename and slide not in tiled_slides:
+            attach_tiles(slide, filename, img)
+    if not tile_builds:
+        pyglet.clock.unschedule(check_tile_builds)
+
+
+def draw_slide(sprite):
+    tiles = tiled_slides.get(sprite)
+    if tiles is not None and sprite.visible:
+        # The sprite shows the image scaled down to its decoded size
+        tiles.update(x=sprite.x, y=sprite.y, scale=sprite.scale * sprite.image.width / tiles.pyramid.width,
+                     opacity=sprite.opacity)
+        # Only worth drawing when they're sharper than the decoded image
+        if tiles.pyramid.levels[tiles.get_level()][0] > sprite.image.width:
+            if tiles.draw():
+                request_redraw()
+            return
+    sprite.draw()
+
+
+def apply_refined_image(dt):
+    global img, refined_image
+    filename, future = refined_image
+    if not future.done():
+        return
+
+    pyglet.clock.unschedule(apply_refined_image)
+    refined_image = None
+    if filename != image_filename or future.exception() is not None:
+        return
+
+    scale = slide.scale * slide.image.width / future.result().width
+    rescale_motion(scale / slide.scale)
+    img = future.result()
+    show_image(img)
+    slide.scale = scale
+
+
+def get_image_bytes(image):
+    if isinstance(image, AnimationStream):
+        return image.nbytes
+    elif is_gif_animation(image):
+        return sum(frame.image.width * frame.image.height * 4 for frame in image.frames)
+    else:
+        return image.width * image.height * 4
+
+
+def get_prefetch_paths():
+    count = len(image_paths)
+    ahead = [image_index + travel_direction * step
+             for step in range(1, prefetch_ahead + 1)]
+    behind = [image_index - travel_direction * step
+              for step in range(1, prefetch_behind + 1)]
+
+    paths = []
+    for index in ahead + behind:
+        row = image_paths.row(index % count)
+        if image_paths.is_removed(row) or (metadata is not None and not metadata.is_readable(row)):
+            continue
+        path = image_paths.path(row)
+        if path != image_filename and path not in paths:
+            paths.append(path)
+
+    return paths
+
+
+def prefetch_images():
+    if prefetcher is None:
+        return
+    if texture_pool is not None and memory.get_used_bytes() > memory.budget:
+        # Idle textures are the first thing to go
+        texture_pool.trim(0)
+    memory.relax()
+    paths = get_prefetch_paths() if len(image_paths) > 1 else []
+    target_size = get_decode_target_size()
+    memory.set_wanted([image_filename] + paths, target_size)
+    if paths:
+        prefetcher.prefetch(sort_archive_reads(paths), target_size)
 
 
 def center_slide():
@@ -270,9 +3046,10 @@ def center_slide():
 
 
 def setup_slide():
-    width, height = get_width_height(img)
+    start = time.perf_counter()
+    width, height = get_slide_size()
     if ken_burns:
-        randomize_pan_zoom_speeds(img)
+        randomize_pan_zoom_speeds(width, height)
         slide.scale = get_oversize_scale(window, img)
         if is_landscape(width, height):
             slide.y = (window.height - slide.height) / 2
@@ -292,6 +3069,9 @@ def setup_slide():
         slide.x = (window.width - slide.width) / 2
         slide.y = (window.height - slide.height) / 2
 
+    rebase_motion()
+    instrumentation.record_setup(time.perf_counter() - start)
+
 
 def nav_next():
     if len(image_paths) > 0:
@@ -314,40 +3094,138 @@ def nav_prevous():
 
 
 def previous_image():
-    global random_image, image_index, image_filename, img
-    if image_index > 0:
-        image_index -= 1
-    else:
-        image_index = len(image_paths) - 1
-
+    request_slide(-1)
+
+
+def request_slide(direction, position=None):
+    # Starts loading the next readable slide in direction, on from the one
+    # already on its way if there is one. show_requested_slide puts it up
+    # once it's decoded, the current slide carries on animating until then.
+    global pending_slide, travel_direction
+    travel_direction = direction
+    if position is None:
+        position = image_index if pending_slide is None else image_paths.position(pending_slide[0])
+    cancel_requested_slide()
+    count = len(image_paths)
+    for _ in range(count):
+        position = (position + direction) % count
+        row = image_paths.row(position)
+        if image_paths.is_removed(row):
+            continue
+        if metadata is not None and not metadata.is_readable(row):
+            remove_image_row(row)
+            continue
+        filename = image_paths.path(row)
+        try:
+            future = prefetcher.request(filename, get_decode_target_size())
+        except OSError as e:
+            print(f"Can't read {filename}: {e}", file=sys.stderr)
+            remove_image_row(row)
+            continue
+        pending_slide = (row, filename, future, time.perf_counter(), future.done(), direction)
+        pyglet.clock.schedule_interval(show_requested_slide, 0.02)
+        # Prefetched ones go up straight away, ones that won't decode are
+        # skipped here rather than by calling back in
+        if poll_requested_slide():
+            return
+    cancel_requested_slide()
+
+
+def show_requested_slide(dt):
+    if not poll_requested_slide():
+        row, direction = pending_slide[0], pending_slide[5]
+        request_slide(direction, image_paths.position(row))
+
+
+def poll_requested_slide():
+    # Shows the pending slide if it's ready. False when it can't be shown,
+    # after dropping it from the playlist.
+    global pending_slide, image_index, image_filename, img
+    row, filename, future, start, cached, direction = pending_slide
+    if image_paths.is_removed(row):
+        # Deleted while it loaded
+        return False
+    # Exports wait, so the same frames come out every time
+    waiting = export_time is None
+    try:
+        if future.cancelled():
+            # Fell out of the prefetch window, ask again
+            future = prefetcher.request(filename, get_decode_target_size())
+            pending_slide = (row, filename, future, start, cached, direction)
+        if waiting and not future.done():
+            return True
+        image = future.result()
+        if isinstance(image, AnimationStream):
+            if waiting and not image.has_frame():
+                return True
+            # Raises if the first frame won't decode
+            image.get_frame()
+    except DECODE_ERRORS as e:
+        print(f"Can't read {filename}: {e}", file=sys.stderr)
+        remove_image_row(row)
+        return False
+
+    cancel_requested_slide()
+    image_index = image_paths.position(row)
+    image_filename = filename
+    img = image
+    instrumentation.begin_slide(filename, time.perf_counter() - start, cached)
     reset_clock(False)
-    image_filename = image_paths[image_index]
-    img = load_image(image_filename)
-    slide.image = img
-    setup_slide()
+    change_slide(img)
     window.clear()
+    prefetch_images()
+    return True
 
 
-def next_image():
-    global image_index, image_filename, img
+def cancel_requested_slide():
+    global pending_slide
+    pending_slide = None
+    pyglet.clock.unschedule(show_requested_slide)
 
-    if image_index < len(image_paths) - 1:
-        image_index += 1
-    else:
-        image_index = 0
 
-    image_filename = image_paths[image_index]
-    img = load_image(image_filename)
-    return img
+def next_image():
+    global image_index, travel_direction
+    travel_direction = 1
+    for _ in range(len(image_paths)):
+        if image_index < len(image_paths) - 1:
+            image_index += 1
+        else:
+            image_index = 0
+        image = load_playlist_image(image_index)
+        if image is not None:
+            return image
+    return None
+
+
+def load_playlist_image(position):
+    # None for paths that are gone or won't decode, skipped from then on
+    global image_filename
+    row = image_paths.row(position)
+    if image_paths.is_removed(row):
+        return None
+    filename = image_paths.path(row)
+    if metadata is not None and not metadata.is_readable(row):
+        remove_image_row(row)
+        return None
+    try:
+        image = load_image(filename, get_decode_target_size())
+        if isinstance(image, AnimationStream):
+            # Waits for the first frame, which may not decode
+            image.get_frame()
+    except DECODE_ERRORS as e:
+        print(f"Can't read {filename}: {e}", file=sys.stderr)
+        remove_image_row(row)
+        return None
+    image_filename = filename
+    return image
 
 
 def update_image(dt):
-    global img
-    img = next_image()
-    slide.image = img
-    reset_clock(False)
-    setup_slide()
-    window.clear()
+    if dt and pending_slide is not None:
+        # The interval ran out before the last one decoded, keep waiting
+        # for it rather than skip it
+        return
+    request_slide(1)
 
 
 def hide_mouse(dt):
@@ -356,14 +3234,17 @@ def hide_mouse(dt):
 
 
 def hide_progress_bar():
-    progress_bar.opacity = 0
-    background_bar.opacity = 0
+    progress_bar.visible = False
+    background_bar.visible = False
+    request_redraw()
 
 
 def show_progress_bar():
-    progress_bar.opacity = 255
-    background_bar.width = window.width
-    background_bar.opacity = 255
+    progress_bar.visible = True
+    if background_bar.width != window.width:
+        background_bar.width = window.width
+    background_bar.visible = True
+    request_redraw()
 
 
 def get_valid_image_path(base_dir, input_path):
@@ -377,60 +3258,726 @@ def get_valid_image_path(base_dir, input_path):
 
 def get_image_paths(input_list):
     paths = []
+    compiled = {}
     for f in input_list:
         f = f.rstrip()
         if f.endswith(SLIDESHOW_EXTENSION):
-            paths.extend(get_image_paths_from_file(f))
+            paths.extend(compile_playlist(os.path.abspath(f), (), compiled)[0])
         elif f.endswith(IMAGE_EXTENSIONS):
             path = os.path.abspath(f)
             paths.append(path)
+        elif f.endswith(ARCHIVE_EXTENSIONS):
+            paths.extend(get_archive_paths(os.path.abspath(f)))
+
+    return paths
 
+
+def get_archive_paths(path):
+    # A path for each image in the archive, in archive order
+    try:
+        index = get_archive(path)
+    except OSError as e:
+        print(f"Can't read {path}: {e}", file=sys.stderr)
+        return []
+    if index is None:
+        return []
+    return [os.path.join(path, name) for name in index.names]
+
+
+def get_archive(path):
+    # The index of the archive at path, None if it isn't a file. Threads
+    # opening the same new archive at once may both index it.
+    index = archives.get(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if index is not None and (index.stat.st_mtime_ns, index.stat.st_size) == (stat.st_mtime_ns, stat.st_size):
+        return index
+    if not os.path.isfile(path):
+        return None
+    try:
+        index = ArchiveIndex(path, stat)
+    except (ValueError, struct.error, zipfile.BadZipFile, tarfile.TarError) as e:
+        raise OSError(f"Not a readable archive: {e}")
+    archives[path] = index
+    return index
+
+
+def get_archive_member(path):
+    # (archive index, member name) for a path inside an archive, else None
+    for extension in ARCHIVE_EXTENSIONS:
+        end = path.find(extension + os.sep)
+        while end >= 0:
+            end += len(extension)
+            index = get_archive(path[:end])
+            if index is not None:
+                return index, path[end + 1:]
+            end = path.find(extension + os.sep, end)
+    return None
+
+
+def get_archive_index_path(path, stat):
+    key = f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(get_default_cache_dir(), 'archives', digest + '.index')
+
+
+def open_archive_member(path):
+    # A file object reading the member path names, None for plain files.
+    # Decoders take it in place of the name.
+    member = get_archive_member(path)
+    if member is None:
+        return None
+    index, name = member
+    return index.open(name)
+
+
+def stat_image(path):
+    # Members share their archive's times
+    member = get_archive_member(path)
+    if member is None:
+        return os.stat(path)
+    return member[0].stat
+
+
+def sort_archive_reads(paths):
+    # Members of one archive, wherever they are in paths, are put in the
+    # order their data lies in it, and the kernel asked to start reading
+    # them in, so prefetching reads the archive front to back
+    paths = list(paths)
+    members = []
+    for position, path in enumerate(paths):
+        try:
+            member = get_archive_member(path)
+        except OSError:
+            continue
+        if member is not None:
+            index, name = member
+            members.append((position, (index.path, index.get_offset(name)), path, member))
+
+    positions = [member[0] for member in members]
+    for position, (_, _, path, (index, name)) in zip(positions, sorted(members, key=lambda member: member[1])):
+        paths[position] = path
+        index.will_need(name)
     return paths
 
 
 def get_image_paths_from_directory(input_dir='.'):
-    file_list = os.listdir(input_dir)
-    file_paths = [os.path.join(input_dir, f) for f in file_list]
-    return get_image_paths(file_paths)
+    return get_image_paths(scan_directory(input_dir))
+
+
+def scan_directory(input_dir='.', recursive=False, max_depth=None, include=(), exclude=()):
+    pending = [(os.path.abspath(input_dir), 0)]
+    while pending:
+        directory, depth = pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if any(fnmatch.fnmatch(entry.name, pattern) for pattern in exclude):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if is_dir:
+                        if recursive and (max_depth is None or depth < max_depth):
+                            subdirs.append(entry.path)
+                    elif not include or any(fnmatch.fnmatch(entry.name, pattern) for pattern in include):
+                        yield entry.path
+        except OSError as e:
+            print(f"Can't read {directory}: {e}", file=sys.stderr)
+
+        # Stack, so reversed to visit sub directories in listing order
+        pending.extend((subdir, depth + 1) for subdir in reversed(subdirs))
+
+
+def read_ahead(paths):
+    # Reads paths on another thread, yielding None whenever the source
+    # stalls (slow pipe, network share) so partial batches still get shown
+    pending = queue.Queue(maxsize=source_batch_size * 4)
+    done = object()
+
+    def reader():
+        try:
+            for path in paths:
+                pending.put(path)
+        finally:
+            pending.put(done)
+
+    threading.Thread(target=reader, name='image-source-reader', daemon=True).start()
+    while True:
+        try:
+            path = pending.get(timeout=source_batch_seconds)
+        except queue.Empty:
+            yield None
+            continue
+        if path is done:
+            return
+        yield path
+
+
+def batch_image_paths(paths):
+    batch = []
+    flushed = time.monotonic()
+    found = False
+    for path in paths:
+        if path is not None:
+            batch.append(path)
+        # Flush every path until the first image turns up, so the show can start
+        if (path is None or not found or len(batch) >= source_batch_size
+                or time.monotonic() - flushed > source_batch_seconds):
+            images = get_image_paths(batch)
+            if images:
+                found = True
+                yield images
+            batch = []
+            flushed = time.monotonic()
+
+    images = get_image_paths(batch)
+    if images:
+        yield images
+
+
+def start_image_source(batches):
+    global source_loading
+    source_loading = True
+
+    def read_source():
+        try:
+            for batch in batches:
+                source_batches.put(batch)
+        finally:
+            source_batches.put(None)
+
+    threading.Thread(target=read_source, name='image-source', daemon=True).start()
+
+
+def wait_for_first_images():
+    batch = source_batches.get()
+    if batch is None:
+        return []
+    pyglet.clock.schedule_interval(drain_image_source, source_batch_seconds)
+    return batch
+
+
+def load_first_image():
+    # The first batches from the source may hold nothing readable
+    global image_index
+    image = load_playlist_image(image_index) or next_image()
+    while image is None and source_loading:
+        batch = source_batches.get()
+        if batch is None:
+            # Left for drain_image_source to finish up
+            source_batches.put(None)
+            break
+        if reconciler is not None:
+            batch = reconciler.match(batch)
+        first = len(image_paths)
+        image_paths.extend(batch)
+        metadata.update()
+        for row in range(first, len(image_paths)):
+            image = load_playlist_image(image_paths.position(row))
+            if image is not None:
+                image_index = image_paths.position(row)
+                break
+    return image
+
+
+def drain_image_source(dt):
+    global source_loading
+    while True:
+        try:
+            batch = source_batches.get_nowait()
+        except queue.Empty:
+            return
+        if batch is None:
+            pyglet.clock.unschedule(drain_image_source)
+            source_loading = False
+            if reconciler is not None:
+                finish_reconcile()
+            osd_small(f"{len(image_paths) - len(image_paths.removed)} images")
+            return
+        if reconciler is not None:
+            batch = reconciler.match(batch)
+            if not batch:
+                continue
+        add_image_paths(batch)
+
+
+def finish_reconcile():
+    # Whatever the source no longer lists has gone since the session was saved
+    global reconciler
+    for row in reconciler.get_missing():
+        remove_image_row(row)
+    reconciler = None
+    prefetch_images()
+
+
+def add_image_paths(paths):
+    global image_index
+    first_position = len(image_paths)
+    row = image_paths.row(image_index)
+    image_paths.extend(paths)
+    metadata.update()
+    if random_image:
+        image_paths.scatter(first_position, image_index + 1)
+        # Still the slide on screen
+        image_index = image_paths.position(row)
+    prefetch_images()
+    request_redraw()
+
+
+def start_watcher(directory, recursive=False, max_depth=None, include=(), exclude=()):
+    global watcher
+    try:
+        watcher = InotifyWatcher(directory, watch_events, recursive, max_depth, include, exclude)
+    except (OSError, AttributeError) as e:
+        # Not Linux, or out of inotify watches
+        print(f"Watching {directory} by polling: {e}", file=sys.stderr)
+        watcher = PollingWatcher(directory, watch_events, recursive, max_depth, include, exclude,
+                                 interval=watch_poll_seconds)
+    watcher.start()
+    pyglet.clock.schedule_interval(drain_watch_events, 1.0)
+
+
+def drain_watch_events(dt):
+    if source_loading:
+        # The first scan may list the same files, wait for it to finish
+        return
+
+    changes = {}
+    while True:
+        try:
+            kind, path = watch_events.get_nowait()
+        except queue.Empty:
+            break
+        # The latest event for a path wins, in the order they happened
+        changes.pop(path, None)
+        changes[path] = kind
+    if not changes:
+        return
+
+    added = []
+    for path, kind in changes.items():
+        if kind == 'removed_directory':
+            for row in image_paths.find_under(path):
+                remove_image_row(row)
+            continue
+        if path.endswith(ARCHIVE_EXTENSIONS):
+            # Its members come and go with it, matched by name
+            archive_paths = get_archive_paths(path) if kind == 'added' else []
+            members = set(archive_paths)
+            for row in image_paths.find_under(path):
+                member = image_paths.path(row)
+                if member in members:
+                    refresh_image_row(row)
+                    members.discard(member)
+                else:
+                    remove_image_row(row)
+            added.extend(member for member in archive_paths if member in members)
+            continue
+        rows = image_paths.find(path)
+        if kind == 'removed':
+            for row in rows:
+                remove_image_row(row)
+        elif rows:
+            # Rewritten, or back again after being moved away
+            for row in rows:
+                refresh_image_row(row)
+        else:
+            added.append(path)
+
+    added = get_image_paths(added)
+    if added:
+        add_image_paths(added)
+    else:
+        prefetch_images()
+
+
+def remove_image_row(row):
+    # The current slide stays up until the next one, image_index doesn't move
+    image_paths.remove(row)
+    if prefetcher is not None:
+        prefetcher.forget(image_paths.path(row))
+
+
+def refresh_image_row(row):
+    image_paths.restore(row)
+    if prefetcher is not None:
+        prefetcher.forget(image_paths.path(row))
+    metadata.refresh(row)
+
+
+def read_image_metadata(path):
+    try:
+        stat = stat_image(path)
+    except OSError:
+        return 0.0, 0.0, 0, 0, 0, 0.0, False
+
+    width, height, taken, valid = probe_image(path)
+    return stat.st_ctime, stat.st_mtime, stat.st_size, width, height, taken, valid
+
+
+def probe_image(path):
+    # (width, height, EXIF time taken, readable) from the first bytes of the
+    # file, without decoding it. Formats without a header reader here are
+    # taken as readable, with zero width and height.
+    try:
+        with open_archive_member(path) or open(path, 'rb') as file:
+            head = file.read(32)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                if head[12:16] != b'IHDR' or len(head) < 24:
+                    return 0, 0, 0.0, False
+                width, height = struct.unpack('>II', head[16:24])
+                return width, height, 0.0, width > 0 and height > 0
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                width, height = struct.unpack('<HH', head[6:10])
+                return width, height, 0.0, True
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                width, height = read_webp_size(head)
+                return width, height, 0.0, width > 0
+            if head[:2] == b'BM':
+                width, height = struct.unpack('<ii', head[18:26])
+                return width, abs(height), 0.0, True
+            if head[:2] == b'\xff\xd8':
+                file.seek(2)
+                # No frame header before the data or the end of the file
+                width, height, taken = read_jpeg_header(file)
+                return width, height, taken, width > 0
+    except (OSError, struct.error):
+        return 0, 0, 0.0, False
+
+    # Renamed TIFFs decode fine through Pillow
+    known = head[:4] in (b'II*\0', b'MM\0*')
+    return 0, 0, 0.0, bool(head) and (known or not path.lower().endswith(PROBED_EXTENSIONS))
+
+
+def read_webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8X':
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height
+    if chunk == b'VP8L':
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    return 0, 0
+
+
+def read_jpeg_header(file):
+    taken = 0.0
+    while True:
+        marker = file.read(4)
+        if len(marker) < 4 or marker[0] != 0xff:
+            break
+        code = marker[1]
+        length = struct.unpack('>H', marker[2:])[0]
+        if code in (0xd9, 0xda):  # End of image, start of scan
+            break
+        if code == 0xe1 and not taken:
+            segment = file.read(length - 2)
+            if segment.startswith(b'Exif\0\0'):
+                taken = read_exif_date_taken(segment[6:])
+            continue
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', file.read(5)[1:])
+            return width, height, taken
+        file.seek(length - 2, os.SEEK_CUR)
+    return 0, 0, taken
+
+
+def read_exif_date_taken(tiff):
+    order = '<' if tiff[:2] == b'II' else '>'
+
+    def find_tag(ifd_offset, wanted):
+        count = struct.unpack_from(order + 'H', tiff, ifd_offset)[0]
+        for entry in range(count):
+            tag, kind, size, value = struct.unpack_from(order + 'HHII', tiff, ifd_offset + 2 + entry * 12)
+            if tag == wanted:
+                return kind, size, value, ifd_offset + 2 + entry * 12 + 8
+        return None
+
+    try:
+        ifd0 = struct.unpack_from(order + 'I', tiff, 4)[0]
+        exif_ifd = find_tag(ifd0, 0x8769)
+        # DateTimeOriginal, or the IFD0 DateTime when there's no Exif IFD
+        date = exif_ifd and find_tag(exif_ifd[2], 0x9003) or find_tag(ifd0, 0x0132)
+        if date is None:
+            return 0.0
+        _, size, offset, _ = date
+        text = tiff[offset:offset + size].rstrip(b'\0 ').decode('ascii')
+        return time.mktime(time.strptime(text, '%Y:%m:%d %H:%M:%S'))
+    except (struct.error, ValueError, OverflowError):
+        return 0.0
 
 
 def get_image_paths_from_stdin():
-    file_list = sys.stdin.readlines()
+    return get_image_paths(read_stdin_paths())
+
+
+def read_stdin_paths(stdin=None):
+    stdin = stdin or sys.stdin.buffer
     base_dir = os.getcwd()  # Get the current working directory
 
-    # Validate and convert paths to full paths if necessary
-    image_paths = [get_valid_image_path(base_dir, path.strip())
-                   for path in file_list]
+    # One line at a time, so paths can be shown while the producer is still running
+    for line in stdin:
+        path = os.fsdecode(line).strip()
+        if path:
+            # Validate and convert paths to full paths if necessary
+            yield get_valid_image_path(base_dir, path)
+
 
-    return get_image_paths(image_paths)
+def read_source_file(file_path):
+    # The paths in an archive or a playlist named as the source, as one batch
+    if file_path.endswith(ARCHIVE_EXTENSIONS):
+        yield get_archive_paths(os.path.abspath(file_path))
+    else:
+        yield get_image_paths_from_file(file_path)
 
 
 def get_image_paths_from_file(file_path):
+    return list(compile_playlist(os.path.abspath(file_path), (), {})[0])
+
+
+def compile_playlist(file_path, including, compiled):
+    # Returns (image paths, {playlist: mtime_ns} it depends on, playlists
+    # skipped to break a cycle). Each playlist is expanded once per compile,
+    # and reused from its index on later runs while none of its files change.
+    if file_path in including:
+        print(f"Skipping {file_path}, it includes itself", file=sys.stderr)
+        return (), {}, {file_path}
+
+    if file_path in compiled:
+        return compiled[file_path]
+
+    index = read_playlist_index(file_path)
+    # An index that went through an outer playlist hides the cycle
+    if index is not None and not any(path in index[1] for path in including):
+        compiled[file_path] = index + (set(),)
+        return compiled[file_path]
+
+    dependencies = {file_path: os.stat(file_path).st_mtime_ns}
     with open(file_path, 'r') as file:
         file_list = file.readlines()
 
     base_dir = os.path.dirname(file_path)  # Get the directory containing the file
+    paths = []
+    cycles = set()
+    for line in file_list:
+        # Validate and convert paths to full paths if necessary
+        path = os.path.abspath(get_valid_image_path(base_dir, line.strip()))
+        if path.endswith(SLIDESHOW_EXTENSION):
+            included = compile_playlist(path, including + (file_path,), compiled)
+            paths.extend(included[0])
+            dependencies.update(included[1])
+            cycles |= included[2]
+        elif path.endswith(IMAGE_EXTENSIONS):
+            paths.append(path)
+        elif path.endswith(ARCHIVE_EXTENSIONS):
+            archive_paths = get_archive_paths(path)
+            if archive_paths:
+                # So the index is compiled again when the archive changes
+                dependencies[path] = os.stat(path).st_mtime_ns
+                paths.extend(archive_paths)
+
+    cycles.discard(file_path)
+    result = (tuple(paths), dependencies, cycles)
+    # An expansion cut short by an outer playlist's cycle depends on
+    # where it was included from, so it can't be reused
+    if not cycles:
+        compiled[file_path] = result
+        write_playlist_index(file_path, result[0], dependencies)
+
+    return result
 
-    # Validate and convert paths to full paths if necessary
-    image_paths = [get_valid_image_path(base_dir, path.strip()) for path in file_list]
 
-    return get_image_paths(image_paths)
+def get_playlist_index_path(file_path):
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.index")
+
+
+def read_playlist_index(file_path):
+    try:
+        with open(get_playlist_index_path(file_path), 'rb') as file:
+            data = file.read()
+        magic, version, dependency_count, paths_size = PLAYLIST_INDEX_HEADER.unpack_from(data)
+        if magic != PLAYLIST_INDEX_MAGIC or version != PLAYLIST_INDEX_VERSION:
+            return None
+
+        offset = PLAYLIST_INDEX_HEADER.size
+        dependencies = {}
+        for _ in range(dependency_count):
+            mtime, size = PLAYLIST_INDEX_DEPENDENCY.unpack_from(data, offset)
+            offset += PLAYLIST_INDEX_DEPENDENCY.size
+            path = os.fsdecode(data[offset:offset + size])
+            offset += size
+            if os.stat(path).st_mtime_ns != mtime:
+                return None
+            dependencies[path] = mtime
+
+        if file_path not in dependencies or len(data) != offset + paths_size:
+            return None
+        paths = data[offset:].split(b'\0') if paths_size else []
+        return tuple(os.fsdecode(path) for path in paths), dependencies
+    except (OSError, struct.error):
+        return None
+
+
+def write_playlist_index(file_path, paths, dependencies):
+    entries = b''.join(PLAYLIST_INDEX_DEPENDENCY.pack(mtime, len(os.fsencode(path))) + os.fsencode(path)
+                       for path, mtime in dependencies.items())
+    paths_blob = b'\0'.join(os.fsencode(path) for path in paths)
+    header = PLAYLIST_INDEX_HEADER.pack(PLAYLIST_INDEX_MAGIC, PLAYLIST_INDEX_VERSION,
+                                        len(dependencies), len(paths_blob))
+
+    index_path = get_playlist_index_path(file_path)
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix='.tmp-')
+    except OSError:
+        # Read-only playlist directory, compile it every time
+        return
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(header + entries + paths_blob)
+        os.replace(temp_path, index_path)
+    except OSError:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
 
 
 def sort_image_paths_by_date_created(reverse=False):
-    global image_index, image_paths
-    image_paths.sort(key=lambda x: os.path.getctime(x), reverse=reverse)
-    image_index = image_paths.index(image_filename)
+    sort_image_paths('created', reverse)
+
+
+def sort_image_paths_by_date_taken(reverse=False):
+    sort_image_paths('taken', reverse)
 
 
 def sort_image_paths_by_alpha(reverse=False):
-    global image_index, image_paths
-    image_paths.sort(key=str.lower, reverse=reverse)
-    image_index = image_paths.index(image_filename)
+    sort_image_paths('alpha', reverse)
+
+
+def sort_image_paths(key, reverse=False):
+    global image_index
+    if key != 'alpha' and not metadata.complete:
+        osd_small(f"Reading image details {len(metadata.taken)}/{len(image_paths)}")
+
+    row = image_paths.row(image_index)
+    order = metadata.get_order(key)
+    if reverse:
+        order = array.array('I', reversed(order))
+    image_paths.set_order(order)
+    image_index = image_paths.position(row)
+    prefetch_images()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='slideshow', add_help=False)
+    parser.add_argument('-h', '--help', action='store_true')
+    parser.add_argument('source', nargs='?')
+    parser.add_argument('--decoder', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--full-resolution', action='store_true')
+    parser.add_argument('--disk-cache', action='store_true')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--cache-size', type=int, default=None)
+    parser.add_argument('--warm-cache', action='store_true')
+    parser.add_argument('--transition', choices=('none', 'crossfade', 'slide', 'zoom'),
+                        default=transition)
+    parser.add_argument('--transition-time', type=float, default=transition_seconds)
+    parser.add_argument('--idle', action='store_true')
+    parser.add_argument('--memory-budget', type=int, default=None)
+    parser.add_argument('--metrics', metavar='FILE|-', default=None)
+    parser.add_argument('--export', metavar='DIR|-', default=None)
+    parser.add_argument('--export-size', type=parse_size, default=(1920, 1080))
+    parser.add_argument('--export-fps', type=float, default=export_fps)
+    parser.add_argument('--export-duration', type=float, default=None)
+    parser.add_argument('--random', action='store_true')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-R', '--recursive', action='store_true')
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--include', action='append', default=[])
+    parser.add_argument('--exclude', action='append', default=[])
+    parser.add_argument('--watch', action='store_true')
+    parser.add_argument('--resume', action='store_true')
+    args = parser.parse_args(argv)
+    if args.full_resolution and (args.disk_cache or args.cache_dir or args.warm_cache):
+        # The disk cache only keeps display size decodes, it would sit unused
+        parser.error("--full-resolution can't be used with the disk cache, "
+                     "which only keeps images decoded at display size")
+    return args
+
+
+def parse_size(text):
+    try:
+        width, height = (int(value) for value in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, not {text}")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, not {text}")
+    return width, height
+
+
+def export_slideshow(exporter, duration):
+    global export_time
+    frame_count = round(duration * export_fps)
+    start = time.perf_counter()
+    for frame in range(frame_count):
+        export_time = frame / export_fps
+        pyglet.clock.tick()
+        exporter.begin_frame()
+        on_draw()
+        exporter.end_frame()
+    exporter.finish()
+    seconds = time.perf_counter() - start
+    print(f"Exported {frame_count} frames in {seconds:.1f}s ({frame_count / max(seconds, 1e-9):.1f} fps)",
+          file=sys.stderr)
+
+
+def get_default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'slideshow')
+
+
+def get_session_path(source, recursive=False, max_depth=None, include=(), exclude=()):
+    # One session per source, and per the options that decide what it lists
+    key = (os.path.abspath(source), recursive, max_depth, tuple(include), tuple(exclude))
+    name = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(get_default_cache_dir(), 'sessions', name)
+
+
+def save_session(dt=None):
+    if session is None or not len(image_paths):
+        return
+    position = min(max(image_index, 0), len(image_paths) - 1)
+    session.save(image_paths, image_paths.row(position), update_interval_seconds,
+                 ken_burns, random_image)
+
+
+def warm_cache(paths, workers):
+    target_size = get_decode_target_size()
+    paths = [path for path in paths if not path.endswith('gif')]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(decode_image, path, target_size) for path in paths]
+        for count, (path, future) in enumerate(zip(paths, futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"\n{path}: {e}", file=sys.stderr)
+            print(f"\rWarming cache {count}/{len(paths)}", end='', file=sys.stderr)
+    print(file=sys.stderr)
 
 
 def goto_start():
     global image_index, image_filename, img
+    cancel_requested_slide()
     image_index = -1
     nav_next()
 
@@ -439,13 +3986,9 @@ def is_landscape(width, height):
     return width > height
 
 
-def is_larger(width, height, window):
-    return width > window.width and height > window.height
-
-
 def get_oversize_scale(window, image):
     scale = get_fit_scale(window, image)
-    return scale * 1.2
+    return scale * oversize_scale
 
 
 def get_width_height(image):
@@ -457,18 +4000,21 @@ def get_width_height(image):
 
 def get_fit_scale(window, image):
     image_width, image_height = get_width_height(image)
+    return get_fit_scale_for_size(window.width, window.height, image_width, image_height)
 
+
+def get_fit_scale_for_size(window_width, window_height, image_width, image_height):
     if is_landscape(image_width, image_height):
-        if is_larger(image_width, image_height, window):
-            scale = window.height / image_height
+        if image_width > window_width and image_height > window_height:
+            scale = window_height / image_height
         else:
-            scale = window.width / image_width
-        if (image_height * scale) > window.height:
-            scale = window.height / image_height
+            scale = window_width / image_width
+        if (image_height * scale) > window_height:
+            scale = window_height / image_height
     else:
-        scale = window.height / image_height
-        if (image_width * scale) > window.width:
-            scale = window.width / image_width
+        scale = window_height / image_height
+        if (image_width * scale) > window_width:
+            scale = window_width / image_width
 
     return scale
 
@@ -496,7 +4042,11 @@ def resume(osd_message=False):
 
 def toggle_ken_burns():
     global ken_burns
+    end_transition()
+    x, y, scale = get_motion_pose(slide_motion, get_animation_time())
+    slide.update(x=x, y=y, scale=scale)
     ken_burns = not ken_burns
+    rebase_motion()
     if ken_burns:
         osd("Ken Burns Effect: On")
     else:
@@ -513,16 +4063,36 @@ def toggle_pause():
 
 
 def toggle_random_image():
-    global random_image, image_paths, image_index
+    global random_image, image_index
     random_image = not random_image
+    row = image_paths.row(image_index)
     if random_image:
-        random.shuffle(image_paths)  # Shuffle the original list for random mode
-        image_index = 0  # Reset image index to start from the beginning
+        image_paths.shuffle(random_seed)  # Shuffle the play order for random mode
         osd("Random")
     else:
-        image_paths = saved_image_paths.copy()  # Use sequential list
-        image_index = saved_image_paths.index(image_filename)  # Restore the original index
+        image_paths.reset_order()  # Use sequential order
         osd("Sequence")
+    image_index = image_paths.position(row)  # Carry on from the current image
+    prefetch_images()
+
+
+def toggle_performance_hud():
+    global performance_hud
+    performance_hud = not performance_hud
+    if performance_hud:
+        pyglet.clock.schedule_interval(update_performance_hud, 0.5)
+        update_performance_hud(0)
+    else:
+        pyglet.clock.unschedule(update_performance_hud)
+        hide_small_status_message(0)
+
+
+def update_performance_hud(dt):
+    osd_small(instrumentation.describe(), delay=1)
+
+
+def get_percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
 
 
 def toggle_fullscreen():
@@ -551,31 +4121,101 @@ def resize_window_to_screen():
     window.height = height
 
 
-def progress_bar_draw():
-    progress_bar.width = window.width * ((image_index + 1) / len(image_paths))
-    background_bar.draw()
-    progress_bar.draw()
+def update_progress_bar():
+    width = 0
+    if len(image_paths) > 0:
+        width = window.width * ((image_index + 1) / len(image_paths))
+    if progress_bar.width != width:
+        progress_bar.width = width
+
+
+def create_slides():
+    global texture_pool, slide, outgoing_slide
+    texture_pool = memory.texture_pool = TexturePool()
+    # Placeholder until show_image gives it a pooled texture
+    slide = pyglet.sprite.Sprite(pyglet.image.Texture.create(1, 1))
+    outgoing_slide = pyglet.sprite.Sprite(slide.image)
+    outgoing_slide.visible = False
+
 
+def create_overlay():
+    global slide_frame, background_bar, progress_bar
+    global status_label, status_label_small, banner_label
+    slide_frame = create_slide_frame()
+    background_bar = pyglet.shapes.Rectangle(0, 0, window.width, progress_bar_height, color=(50,50,50),
+                                             batch=overlay_batch, group=progress_background_group)
+    progress_bar = pyglet.shapes.Rectangle(0, 0, 0, progress_bar_height, color=(255, 255, 255),
+                                           batch=overlay_batch, group=progress_group)
 
-def draw_rect(x, y, width, height, stroke_width=2, color=(0,0,0)):
-    pyglet.shapes.Line(x, y, x + width, y, width=stroke_width, color=color).draw()
-    pyglet.shapes.Line(x + width, y, x + width, y + height, width=stroke_width, color=color).draw()
-    pyglet.shapes.Line(x + width, y + height, x, y + height, width=stroke_width, color=color).draw()
-    pyglet.shapes.Line(x, y + height, x, y, width=stroke_width, color=color).draw()
+    hide_progress_bar()
+
+    status_label = ShadowLabel(
+        '',
+        x=10,
+        y=10,
+        anchor_x='left',
+        anchor_y='bottom',
+        batch=overlay_batch,
+        group=label_group
+    )
+
+    status_label_small = ShadowLabel(
+        '',
+        x=10,
+        y=10,
+        anchor_x='right',
+        anchor_y='bottom',
+        font_size=12,
+        batch=overlay_batch,
+        group=label_group
+    )
+
+    banner_label = ShadowLabel(
+        "",
+        10,
+        10,
+        anchor_x='center',
+        anchor_y='center',
+        font_size=15,
+        font_name="Monaco",
+        width=window.width,
+        multiline=True,
+        batch=overlay_batch,
+        group=label_group
+    )
+
+
+def create_slide_frame(stroke_width=2, color=(0,0,0)):
+    return [pyglet.shapes.Line(0, 0, 0, 0, width=stroke_width, color=color,
+                               batch=overlay_batch, group=frame_group)
+            for _ in range(4)]
+
+
+def update_slide_frame():
+    global slide_frame_rect
+    rect = (slide.x, slide.y, slide.width, slide.height)
+    if rect == slide_frame_rect:
+        return
+
+    slide_frame_rect = rect
+    x, y, width, height = rect
+    corners = ((x, y), (x + width, y), (x + width, y + height), (x, y + height))
+    for index, line in enumerate(slide_frame):
+        line.position = corners[index]
+        line.x2, line.y2 = corners[(index + 1) % 4]
 
 
 @window.event
 def on_draw():
+    start = time.perf_counter()
     window.clear()
-    slide.draw()
-    draw_rect(slide.x, slide.y, slide.width, slide.height)
-
-    status_label.draw()
-    status_label_small.draw()
-    banner_label.draw()
-
-    if len(image_paths) > 0:
-        progress_bar_draw()
+    if transition_start is not None:
+        draw_slide(outgoing_slide)
+    draw_slide(slide)
+    update_slide_frame()
+    update_progress_bar()
+    overlay_batch.draw()
+    instrumentation.record_frame(start, time.perf_counter() - start)
 
 
 @window.event
@@ -628,6 +4268,23 @@ def on_key_release(symbol, modifiers):
         osd("sort alpha desc")
         sort_image_paths_by_alpha(reverse=True)
 
+    elif key.C == symbol:
+        osd("Sort taken asc")
+        sort_image_paths_by_date_taken(reverse=False)
+
+    elif key.V == symbol:
+        osd("Sort taken desc")
+        sort_image_paths_by_date_taken(reverse=True)
+
+    elif key.T == symbol:
+        osd_small(texture_pool.describe(), delay=3)
+
+    elif key.P == symbol:
+        toggle_performance_hud()
+
+    elif key.M == symbol:
+        osd_small(memory.describe(), delay=3)
+
     elif key.SLASH == symbol:
         osd_banner(help_osd)
 
@@ -670,6 +4327,7 @@ def on_mouse_release(x, y, button, modifiers):
 @window.event
 def on_mouse_scroll(x, y, scroll_x, scroll_y):
     global slide
+    end_transition()
 
     # Calculate the zoom factor based on scroll direction
     zoom_factor = 0.98 if scroll_y < 0 else 1.01
@@ -684,6 +4342,8 @@ def on_mouse_scroll(x, y, scroll_x, scroll_y):
 
     # Apply the zoom factor to the image
     slide.scale *= zoom_factor
+    rebase_motion()
+    refine_slide_resolution()
 
     # Redraw the image
     window.clear()
@@ -692,8 +4352,10 @@ def on_mouse_scroll(x, y, scroll_x, scroll_y):
 @window.event
 def on_mouse_drag(x, y, dx, dy, buttons, modifiers):
     global slide, drag_pan
+    end_transition()
     slide.x += dx
     slide.y += dy
+    rebase_motion()
     drag_pan = True
 
     # Redraw the image
@@ -711,76 +4373,169 @@ def on_mouse_motion(x, y, dx, dy):
 @window.event
 def on_resize(width,height):
     setup_slide()
+    refine_slide_resolution()
+
+
+@window.event
+def on_expose():
+    request_redraw()
 
 
 if __name__ == '__main__':
     try:
-        args = None
-        if len(sys.argv) > 1:
-            args = sys.argv[1]
+        args = parse_args(sys.argv[1:])
 
-        if args and args == '-h' or args == '--help;':
+        if args.help:
             print(help_usage, file=sys.stderr)
             sys.exit(0)
 
-        if args:
-            if os.path.isdir(args):
-                image_paths = get_image_paths_from_directory(args)
-            elif os.path.isfile(args):
-                image_paths = get_image_paths_from_file(args)
-        else:
+        if args.export:
+            # Everything time based runs on the export's virtual clock, in a
+            # window the size of the exported frames
+            export_time = 0.0
+            export_fps = args.export_fps
+            pyglet.clock.set_default(pyglet.clock.Clock(time_function=get_animation_time))
+            window.close()
+            window = pyglet.window.Window(*args.export_size, visible=False)
+
+        # Warming the cache and exporting need the whole list up front
+        read_all_first = args.warm_cache or args.export
+
+        if args.watch and not (args.source and os.path.isdir(args.source)):
+            print("--watch needs a directory, not watching", file=sys.stderr)
+
+        if args.resume and not args.source:
+            print("--resume needs a directory or file source, not resuming", file=sys.stderr)
+
+        # Sessions are only kept for runs that ask to resume
+        snapshot = None
+        if args.resume and args.source and not read_all_first:
+            session = Session(get_session_path(args.source, args.recursive, args.max_depth,
+                                               args.include, args.exclude))
+            snapshot = session.load()
+
+        if args.source:
+            if os.path.isdir(args.source):
+                if args.watch and not args.export:
+                    # Before scanning, so files added during the scan aren't missed
+                    start_watcher(args.source, args.recursive, args.max_depth,
+                                  args.include, args.exclude)
+                paths = scan_directory(args.source, args.recursive, args.max_depth,
+                                       args.include, args.exclude)
+                if read_all_first:
+                    image_paths = get_image_paths(paths)
+                else:
+                    start_image_source(batch_image_paths(read_ahead(paths)))
+            elif os.path.isfile(args.source):
+                batches = read_source_file(args.source)
+                if snapshot is not None:
+                    # Read on the source thread
+                    start_image_source(batches)
+                else:
+                    image_paths = [path for batch in batches for path in batch]
+        elif read_all_first:
             image_paths = get_image_paths_from_stdin()
+        else:
+            start_image_source(batch_image_paths(read_ahead(read_stdin_paths())))
+
+        if snapshot is not None:
+            # Shown straight from the session, the source is listed again
+            # in the background to catch up with what changed since
+            image_paths, row, update_interval_seconds, ken_burns, random_image = snapshot
+            image_index = image_paths.position(row)
+            if source_loading:
+                reconciler = PlaylistReconciler(image_paths)
+                pyglet.clock.schedule_interval(drain_image_source, source_batch_seconds)
+        elif source_loading:
+            image_paths = wait_for_first_images()
 
         if len(image_paths) < 1:
             print("No images found in source", file=sys.stderr)
             sys.exit(1)
         else:
-            saved_image_paths = image_paths.copy()
-            image_filename = image_paths[image_index]
-            img = load_image(image_filename)
-            slide = pyglet.sprite.Sprite(img)
-            background_bar = pyglet.shapes.Rectangle(0, 0, window.width, progress_bar_height, color=(50,50,50))
-            progress_bar = pyglet.shapes.Rectangle(0, 0, 0, progress_bar_height, color=(255, 255, 255))
-
-            hide_progress_bar()
-
-            status_label = ShadowLabel(
-                '',
-                x=10,
-                y=10,
-                anchor_x='left',
-                anchor_y='bottom'
-            )
-
-            status_label_small = ShadowLabel(
-                '',
-                x=10,
-                y=10,
-                anchor_x='right',
-                anchor_y='bottom',
-                font_size=12
-            )
-
-            banner_label = ShadowLabel(
-                "",
-                10,
-                10,
-                anchor_x='center',
-                anchor_y='center',
-                font_size=15,
-                font_name="Monaco",
-                width=window.width,
-                multiline=True
-            )
+            if snapshot is None:
+                image_paths = Playlist(image_paths)
+            metadata = MetadataIndex(image_paths)
+            random_seed = args.seed
+            if args.random and snapshot is None:
+                random_image = True
+                image_paths.shuffle(random_seed)
+            decode_at_display_size = not args.full_resolution
+            if args.decoder == 'process':
+                workers = args.workers or os.cpu_count() or 2
+                decode_pool = start_decode_pool(workers)
+                if decode_pool is not None:
+                    prefetch_workers = workers
+            elif args.workers:
+                prefetch_workers = args.workers
+
+            if args.disk_cache or args.cache_dir or args.warm_cache:
+                if args.cache_size:
+                    disk_cache_size = args.cache_size * 1024 * 1024
+                disk_cache = DiskCache(args.cache_dir or get_default_cache_dir(), disk_cache_size)
+
+            if args.warm_cache:
+                window.set_visible(False)
+                warm_cache(image_paths, args.workers or os.cpu_count() or 2)
+                disk_cache.evict()
+                sys.exit(0)
+
+            if args.metrics:
+                instrumentation.output = sys.stderr if args.metrics == '-' else open(args.metrics, 'a')
+
+            if args.memory_budget:
+                memory.budget = args.memory_budget * 1024 * 1024
+            prefetcher = Prefetcher(ImageCache(memory), prefetch_workers)
+            img = load_first_image()
+            if img is None:
+                print("No readable images found in source", file=sys.stderr)
+                sys.exit(1)
+            create_slides()
+            transition = args.transition
+            transition_seconds = max(args.transition_time, 0.01)
+            frame_interval = 1 / export_fps if args.export else get_frame_interval()
+            show_image(img)
+            attach_tiles(slide, image_filename, img)
+            create_overlay()
 
             setup_slide()
 
             pyglet.clock.schedule_interval(update_image, update_interval_seconds)
-            pyglet.clock.schedule_interval(update_pan, 1/60.0)
-            pyglet.clock.schedule_interval(update_zoom, 1/60.0)
             pyglet.clock.schedule_once(hide_mouse, mouse_hide_delay)
-
-            pyglet.app.run()
+            if session is not None:
+                pyglet.clock.schedule_interval(save_session, session_save_seconds)
+            prefetch_images()
+
+            instrumentation.write(dict(event='run', time=time.time(), pyglet=pyglet.version,
+                                       renderer=pyglet.gl.gl_info.get_renderer(),
+                                       decoder=args.decoder, workers=prefetch_workers,
+                                       images=len(image_paths), window=window.get_size()))
+            if args.export:
+                output = args.export
+                if output == '-':
+                    output = sys.stdout.buffer
+                else:
+                    os.makedirs(output, exist_ok=True)
+                exporter = FrameExporter(*args.export_size, output, os.cpu_count() or 2)
+                try:
+                    export_slideshow(exporter, args.export_duration or len(image_paths) * update_interval_seconds)
+                finally:
+                    instrumentation.write(dict(event='memory', **memory.get_usage()))
+                    instrumentation.close()
+            else:
+                event_loop = pyglet.app.event_loop = IdleEventLoop(on_demand=args.idle)
+                instrumentation.event_loop = event_loop
+                try:
+                    event_loop.run(frame_interval)
+                finally:
+                    # Quitting exits from inside the loop
+                    save_session()
+                    instrumentation.write(dict(event='memory', **memory.get_usage()))
+                    instrumentation.close()
+            texture_pool.clear()
+            prefetcher.shutdown()
+            if decode_pool is not None:
+                decode_pool.shutdown(cancel_futures=True)
 
     except Exception as e:
         print("There was an error")